@@ -11,9 +11,15 @@ import os
 import logging
 import time
 import datetime
+import calendar
 import ntpath
-import struct
+import glob
 import functools
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 import numpy as np
 import matplotlib as mpl
@@ -37,9 +43,16 @@ except ImportError:
     pygameImported = False
 
 # Project libraries
-import ops.hkdata as hkdata
+import ops.hkarchive as hkarchive
+import ops.hkbeacon as hkbeacon
+import ops.hkcache as hkcache
+import ops.hkdecoder as hkdecoder
+import ops.hkseries as hkseries
+import ops.hksnapshot as hksnapshot
+import ops.hksteady as hksteady
+import ops.hkview as hkview
 import mapping
-from rabbitmq import RabbitMQClient
+from rabbitmq import AsyncRabbitMQClient
 
 __version__ = '3.2.0'
 
@@ -51,18 +64,11 @@ logging.basicConfig(filename='monitor.log',
                     level=logging.DEBUG)
 logging.info('\n\n++++++++++++++ Program started +++++++++++++++++\n\n')
 
-logger = logging.getLogger(__name__)
-hdlr = logging.FileHandler('rawdata.log')
-formatter = logging.Formatter('[%(asctime)s %(module)s:%(lineno)s] '
-                              '%(levelname)-8s %(message)s')
-hdlr.setFormatter(formatter)
-logger.addHandler(hdlr)
-logger.setLevel(logging.INFO)
+# Raw data of all received beacons (see `ops.hkarchive`)
+rawArchive = hkarchive.RawArchive('rawdata.hkraw')
 
 beaconTime = 0
 globalData = {}
-rawtime = {}
-rawdata = {}
 
 
 ##############################################################################
@@ -76,10 +82,71 @@ mpl.rcParams['svg.fonttype'] = 'none'
 # Argument Parsing
 ##############################################################################
 modes = ['simulation', 'tvac', 'em', 'fm']
-args = sys.argv
+# Options start with '--' and may be given in any position
+options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+args = [arg for arg in sys.argv if not arg.startswith('--')]
 fileMode = False
+fileNames = []
+decodeProcesses = None
+decodeTrace = 0
+decodeCache = hkcache.DecodedFileCache()
+followMode = False
+dropDuplicates = False
+blitMode = True
+renderFps = 10
+retentionHours = 24
+resumeMode = False
+for option in options:
+    if option.startswith('--processes='):
+        # Decode files with this many worker processes. By default, a single
+        # file is decoded in-process and several files by one process per CPU
+        decodeProcesses = int(option.split('=', 1)[1])
+    elif option.startswith('--trace='):
+        # Log every n-th decoded record field by field
+        decodeTrace = int(option.split('=', 1)[1])
+    elif option == '--no-cache':
+        decodeCache = None
+    elif option == '--follow':
+        # Keep reading records appended to the file given as mode
+        followMode = True
+    elif option == '--drop-duplicates':
+        # Drop samples that repeat the timestamp and value of another one
+        dropDuplicates = True
+    elif option == '--no-blit':
+        # Always redraw the whole canvas in live mode
+        blitMode = False
+    elif option.startswith('--fps='):
+        # Redraw live plots at most this many times per second
+        renderFps = float(option.split('=', 1)[1])
+    elif option.startswith('--retention='):
+        # Keep live data at full resolution for this many hours, then as
+        # 1-minute and 1-hour rollups
+        retentionHours = float(option.split('=', 1)[1])
+    elif option == '--resume':
+        # Start live mode with the data of the last snapshot of the mode
+        resumeMode = True
+    else:
+        print("Unknown option {}. Possible options are --processes=N, "
+              .format(option) + "--trace=N, --no-cache, --follow, "
+              "--drop-duplicates, --no-blit, --fps=N, --retention=N and "
+              "--resume.")
+        exit()
 if len(args) >= 2:
-    fileMode = os.path.isfile(args[1])
+    # Files may be given as a directory, as glob patterns or as a list
+    if args[1] not in modes:
+        for arg in args[1:]:
+            # A file name may contain characters special to glob, e.g. [
+            if os.path.isfile(arg):
+                fileNames.append(arg)
+                continue
+            if os.path.isdir(arg):
+                arg = os.path.join(arg, '*')
+            fileNames.extend(sorted(name for name in glob.glob(arg)
+                                    if os.path.isfile(name)))
+    fileMode = len(fileNames) > 0
+    if followMode and len(fileNames) > 1:
+        print("Only a single file can be followed.")
+        exit()
     if args[1] in modes or fileMode:
         mode = args[1]
         print("mode {} is a known mode or a file".format(mode))
@@ -282,36 +349,162 @@ class AlarmThread(QtCore.QThread):
         self.startAlarm()
 
 
+class SteadyStateThread(QtCore.QThread):
+    """
+    Runs the steady state detection (see `hksteady.SteadyStateDetector`) off
+    the GUI thread. New samples are queued with `add`, and the steady state
+    definition is changed with `configure`. Only changes of the state of a
+    sensor are signalled.
+    """
+    def __init__(self, threshold, timeRange):
+        super(SteadyStateThread, self).__init__()
+        self.detector = hksteady.SteadyStateDetector(threshold, timeRange)
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+
+
+    def add(self, samples):
+        """
+        Queues new samples, given as a dict with sensor names as keys and
+        (times, values) tuples as values.
+        """
+        self.tasks.put(('add', samples))
+
+
+    def configure(self, threshold, timeRange, history):
+        """
+        Queues a change of the steady state definition. See
+        `hksteady.SteadyStateDetector.configure`.
+        """
+        self.tasks.put(('configure', (threshold, timeRange, history)))
+
+
+    def states(self):
+        """
+        Returns the current state of every sensor.
+        """
+        with self.lock:
+            return dict(self.detector.steady)
+
+
+    def run(self):
+        while True:
+            task, args = self.tasks.get()
+            with self.lock:
+                if task == 'configure':
+                    changes = self.detector.configure(*args)
+                else:
+                    changes = {}
+                    for sensor, (times, values) in args.items():
+                        steady = self.detector.add(sensor, times, values)
+                        if steady is not None:
+                            changes[sensor] = steady
+            for sensor, steady in changes.items():
+                self.emit(SIGNAL(
+                    'steady_state_changed(PyQt_PyObject, PyQt_PyObject)'),
+                    sensor, steady)
+
+
+class SnapshotThread(QtCore.QThread):
+    """
+    Writes snapshots of the live data (see `hksnapshot`) off the GUI
+    thread. At most one snapshot waits to be written; while it waits, newer
+    ones are skipped.
+    """
+    def __init__(self, fileName):
+        super(SnapshotThread, self).__init__()
+        self.fileName = fileName
+        self.tasks = queue.Queue(maxsize=1)
+
+
+    def add(self, arrays):
+        """
+        Queues arrays returned by `hksnapshot.capture`. Returns False if the
+        previous snapshot is still waiting to be written.
+        """
+        try:
+            self.tasks.put_nowait(arrays)
+        except queue.Full:
+            return False
+        return True
+
+
+    def run(self):
+        while True:
+            arrays = self.tasks.get()
+            start = time.time()
+            try:
+                hksnapshot.save(arrays, self.fileName)
+            except (IOError, OSError) as e:
+                logging.error('Could not write snapshot {}: {}'
+                              .format(self.fileName, e))
+                continue
+            logging.debug('Wrote snapshot {} in {:.3f} s'
+                          .format(self.fileName, time.time() - start))
+
+
 class ConsumerThread(QtCore.QThread):
-    refresh_feed = pyqtSignal('PyQt_PyObject')
+    """
+    Receives beacons from RabbitMQ through `rabbitmq.AsyncRabbitMQClient`,
+    which reconnects by itself whenever the connection is lost. Messages are
+    parsed and validated by `hkbeacon.BeaconParser` against the sensors of
+    `hkdata.thm_bytes` and `mapping.mapping`; malformed ones are counted and
+    dropped. The parser's counters are logged with the consumer's metrics.
+
+    THM beacons are collected by `hkbeacon.BeaconBatcher` and handed to the
+    GUI as one `refresh_batch` signal per batch of at most `batchBeacons`
+    beacons or `batchAge` seconds.
+    """
+    refresh_batch = pyqtSignal('PyQt_PyObject')
+
+    batchBeacons = 50
+    batchAge = 0.1
+
+    def __init__(self):
+        super(ConsumerThread, self).__init__()
+        self.schema = hkbeacon.BeaconSchema(sensorMapping=mapping.mapping)
+        self.parser = hkbeacon.BeaconParser(self.schema)
+        self.batcher = hkbeacon.BeaconBatcher(self.schema, self.batchBeacons,
+                                              self.batchAge)
+        self.rmq = None
+
+
+    def flush(self):
+        """
+        Emits the collected beacons, if any.
+        """
+        batch = self.batcher.take()
+        if batch is not None:
+            self.emit(SIGNAL('refresh_batch(PyQt_PyObject)'), batch)
+
 
     def run(self):
         print("Waiting for beacons...")
 
         def callback(self, channel, method, properties, body):
             global beaconTime
-            body = eval(body)
-            if method.routing_key == 'CDH':
-                beaconTime = body['Beacon Timestamp']
-                beaconTime = datetime.datetime.strptime(beaconTime,
-                                                        '%Y-%m-%dT%H:%M:%S')
+            beacon = self.parser.parse(body, method.routing_key,
+                                       getattr(properties, 'content_type',
+                                               None))
+            if beacon is None:
+                return
+            if beacon.timestamp is not None:
+                beaconTime = beacon.timestamp
             if type(beaconTime).__name__ != 'datetime':
                 return
 
-            if method.routing_key == 'THM':
-                print("Received THM beacon")
-                print(body)
-                del body['Beacon Timestamp']
-                del body['Beacon Version']
-                del body['Source']
-                del body['Source ID']
-                data = []
-                for sensor, value in body.items():
-                    data.append([sensor, beaconTime, value])
-                self.emit(SIGNAL('refresh_feed(PyQt_PyObject)'), data)
+            if beacon.routingKey == hkbeacon.THM:
+                first = not len(self.batcher)
+                if self.batcher.add(beacon, beaconTime):
+                    self.flush()
+                elif first:
+                    # Emit the batch when it is due even if no further
+                    # beacons arrive
+                    self.rmq.addTimeout(self.batchAge, self.flush)
 
-        rmq = RabbitMQClient(rabbitMQConfig)
-        rmq.start(functools.partial(callback, self))
+        self.rmq = AsyncRabbitMQClient(rabbitMQConfig,
+                                       messageSummary=self.parser.summary)
+        self.rmq.start(functools.partial(callback, self))
 
 
 class updateThread(QtCore.QThread):
@@ -324,10 +517,17 @@ class updateThread(QtCore.QThread):
     done = pyqtSignal()
     duplicatesReady = pyqtSignal('PyQt_PyObject')
 
+    # Seconds between intermediate plots while a file is being loaded
+    plotInterval = 2
+    # Seconds between checks for new records in follow mode
+    followInterval = 2
+
 
     def __init__(self):
         super(updateThread, self).__init__()
         self.add.connect(self.addData)
+        # Duplicates and conflicts of the data merged by `processFileData`
+        self.conflicts = hkseries.ConflictReport()
 
 
     def __del__(self):
@@ -338,18 +538,26 @@ class updateThread(QtCore.QThread):
         time.sleep(5)
 
 
-    def processFileData(self, data, purge=False, oldData={}):
+    def processFileData(self, blocks, purge=False, oldData={}):
         """
         Organizes journald THM file contents into a dictionary with sensor
-        names as keys and tuples of x and y data numpy arrays as values. Ushers
-        signal to trigger plotting of the data.
+        names as keys and `hkseries.Series` of x and y data as values. Ushers
+        signal to trigger plotting of the data. Every block is sorted by time
+        on arrival. Blocks are merged with each other by a k-way merge and
+        then into the existing data (see `mergeRuns`), so existing data is
+        never sorted again. The data merged so far is plotted every
+        `plotInterval` seconds. Only the part of each series that a merge
+        may have changed is checked for duplicates and conflicts.
 
         Receives:
-            List    data        The new data as found in the journald file
-                                organized into a list line-by-line
+            iterable blocks     The new data as decoded from the journald
+                                files, organized into blocks of per-sensor
+                                columns (see `blocksFromFiles`)
             boolean purge       Whether or not to discard existing plot data
             dict    oldData     Data that has previously been loaded
         Signals:
+            duplicatesReady     Delivers the `hkseries.ConflictReport` of the
+                                merged data
             plot_all            Triggers plotting of the processed data
         Returns:
             None
@@ -359,184 +567,299 @@ class updateThread(QtCore.QThread):
         else:
             plotData = oldData
 
-        self.track.emit()
-        size = len(data)
-        dups = []
-        for i, line in enumerate(data):
-            for sensorData in line:
-                if i % 100 == 0:
-                    self.progress.emit(size, i,
-                                       'Processing data (line {} of {})'
-                                       .format(i, size))
-
-                sensor = sensorData[0]
-                newx = sensorData[1]
-                newy = sensorData[2]
-
+        if not plotData:
+            self.conflicts = hkseries.ConflictReport()
+
+        # Sorted runs of new data of each sensor, merged into the existing
+        # data whenever data is plotted
+        runs = {}
+        # Index of the first sample of each sensor that merges changed
+        changed = {}
+        lastPlot = time.time()
+        for data in blocks:
+            for sensor, (newx, newy) in data.items():
                 # When plotting from file, system state not relevant
                 if sensor in ('THM System State', 'State', 'Status'):
                     continue
+                runs.setdefault(sensor, []).append(hkseries.sortSeries(newx,
+                                                                       newy))
 
-                x, y = plotData.get(sensor, (np.zeros(0), np.zeros(0)))
-
-                inds, = np.where(x == newx)
-                for ind in inds:
-                    if y[ind] == newy:
-                        pass
-                    else:
-                        dt = mpl.dates.num2date(x[ind])
-                        date = dt.date()
-                        time = dt.time()
-                        print("Two different values for sensor {} at {} {} "
-                              .format(sensor, date, time) +
-                              "found:\nOld: {}, New: {}."
-                              .format(y[ind], newy))
-                        dups.append(newx)
-                newx = np.array([newx])
-                newy = np.array([newy])
-                x = np.concatenate((x, newx))
-                y = np.concatenate((y, newy))
-
-                plotData[sensor] = (x, y)
-        self.duplicatesReady.emit(dups)
-        self.done.emit()
+            if time.time() - lastPlot > self.plotInterval:
+                self.mergeRuns(runs, plotData, changed)
+                self.emit(SIGNAL('plot_all(PyQt_PyObject)'), dict(plotData))
+                lastPlot = time.time()
+        self.mergeRuns(runs, plotData, changed)
 
-        # Sort by time
-        for sensor in plotData:
+        for sensor, start in changed.items():
             x, y = plotData[sensor]
+            self.conflicts.add(sensor, x, y, start)
+        # The GUI keeps the report while this thread goes on changing its own
+        conflicts = self.conflicts.copy()
+        if conflicts.duplicates or conflicts.conflicts:
+            logging.warning(conflicts.summary())
+            print(conflicts.summary())
+        for sensor in sorted(conflicts.conflicts):
+            times, lows, highs = conflicts.conflicts[sensor]
+            print("Different values for sensor {} at {} timestamps between "
+                  .format(sensor, times.size) + "{} and {} (up to {:.1f} apart)"
+                  .format(mpl.dates.num2date(times[0]),
+                          mpl.dates.num2date(times[-1]),
+                          (highs - lows).max()))
+        self.duplicatesReady.emit(conflicts)
 
-            p = x.argsort()
-            x = x[p]
-            y = y[p]
+        self.emit(SIGNAL('plot_all(PyQt_PyObject)'), plotData)
 
-            plotData[sensor] = (x, y)
 
-        self.emit(SIGNAL('plot_all(PyQt_PyObject)'), plotData)
+    @staticmethod
+    def mergeRuns(runs, plotData, changed):
+        """
+        Merges the sorted runs of new data of every sensor with each other
+        and then into the sensor's series in `plotData`. Merged runs are
+        removed. The cost is proportional to the new data and the part of
+        the existing data it overlaps with (see `hkseries.Series.merge`).
+        Exact duplicates are dropped if `dropDuplicates` (command line
+        option --drop-duplicates) is set.
+
+        Receives:
+            dict    runs        Sensor names as keys and lists of (x, y)
+                                tuples sorted by time as values
+            dict    plotData    Sensor names as keys and `hkseries.Series`
+                                as values
+            dict    changed     Sensor names as keys and the index of the
+                                first sample changed by merges as values.
+                                Updated with the merges done
+        Returns:
+            None
+        """
+        global dropDuplicates
+
+        for sensor, sensorRuns in runs.items():
+            if not sensorRuns:
+                continue
+            x, y = hkseries.kwayMerge(sensorRuns)
+            del sensorRuns[:]
+            if sensor not in plotData:
+                plotData[sensor] = hkseries.Series()
+            start = plotData[sensor].merge(x, y, dropDuplicates)
+            changed[sensor] = min(changed.get(sensor, start), start)
 
 
     @pyqtSlot('PyQt_PyObject', 'PyQt_PyObject', 'PyQt_PyObject')
-    def addData(self, file, purge, oldData):
+    def addData(self, files, purge, oldData):
         """
-        Adds data from `file` to existing data or overwrites existing data.
-        Delegates reading and interpretation to `dataFromFile` and plotting to
-        `processFileData`
+        Adds data from `files` to existing data or overwrites existing data.
+        Delegates reading and interpretation to `blocksFromFiles` and plotting
+        to `processFileData`
 
         Receives:
-            Python file object      file    File containing the data to be
-                                            added
-            Boolean                 purge   Whether or not to retain existing
-                                            data
-            dict                    oldData Existing data
+            list        files   Names of the files containing the data to be
+                                added
+            Boolean     purge   Whether or not to retain existing data
+            dict        oldData Existing data
         """
-        data = self.dataFromFile(file)
         if purge:
             self.emit(SIGNAL('discard_data()'))
 
-        self.processFileData(data, purge, oldData)
+        self.processFileData(self.blocksFromFiles(files), purge, oldData)
 
 
-    def convert(self, fileContents):
-        """ Largely adapted from OPS_housekeeping thm_processor """
-        sensorInfo = hkdata.thm_bytes
-        # Split fileContents after 84 bytes and check if last byte is a newline
-        # If it isn't, discard line, search next newline and try to read the 84
-        # bytes after that
-        time = None
-        start = 0
-        end = 0
-        data = []
-        size = len(fileContents)
+    def toDates(self, columns):
+        """
+        Converts the epoch timestamps of decoded columns to matplotlib dates.
+        All sensors share the same timestamp column, so it is only converted
+        once.
+        """
+        dates = {}
+        data = {}
+        for sensor, (times, values) in columns.items():
+            if id(times) not in dates:
+                dates[id(times)] = mpl.dates.epoch2num(times)
+            data[sensor] = (dates[id(times)], values)
+        return data
+
+
+    def blocksFromFile(self, fileName):
+        """
+        Reads a journald log file block by block, so that memory use while
+        decoding is bounded by `hkdecoder.BLOCK_SIZE` no matter how large the
+        file is. If `decodeProcesses` (command line option --processes) is
+        greater than one, the file is instead decoded by a pool of worker
+        processes, which keeps the GUI responsive but holds the whole file.
+        Decoded files are stored in `decodeCache` (disabled with command line
+        option --no-cache) block by block and read from there when they are
+        opened again.
+        Raw beacon archives (see `ops.hkarchive`) are read as a single block.
+
+        Receives:
+            string      fileName    File to be read
+        Yields:
+            dict        data        Interpreted temperature data of one block
+                                    in the format provided by `toDates`
+        """
+        global decodeProcesses
+        global decodeTrace
+        global decodeCache
+
+        total = max(1, os.path.getsize(fileName) //
+                    hkdecoder.recordDtype().itemsize)
+        report = hkdecoder.DecodeReport(traceEvery=decodeTrace)
         self.track.emit()
-        while True:
-            if end >= size:
-                break
-            lineData = []
-            skip = 0
-            self.progress.emit(size, start,
-                               'Reading binary data (line {} of {})'
-                               .format(start, size))
-            for info in sensorInfo:
-                sensorName = info[0]
-                fmt = info[1]
-                interpFunc = info[2]
-
-                end = start + struct.calcsize(fmt)
-                rawin = fileContents[start:end]
+        if hkarchive.isArchive(fileName):
+            self.progress.emit(total, total, 'Reading raw beacon archive')
+            yield self.toDates(hkarchive.readColumns(fileName))
+            self.done.emit()
+            return
+        if decodeCache is not None:
+            columns = decodeCache.load(fileName)
+            if columns is not None:
+                self.progress.emit(total, total, 'Loaded data from cache')
+                yield self.toDates(columns)
+                self.done.emit()
+                return
 
-                try:
-                    rawout = struct.unpack(fmt, rawin)[0]
-                except struct.error as e:
-                    logging.error("Failed to unpack raw value for {}"
-                                  .format(sensorName) +
-                                  " (value: {}, expected size: {}).\n"
-                                  .format(rawin, struct.calcsize(fmt)) +
-                                  "The last completely successfully read" +
-                                  " data set was at {} (satellite time)"
-                                  .format(mpl.dates.num2date(time)))
-                    continue
+        # Blocks are written to the cache as they are decoded, not kept
+        writer = None
+        if decodeCache is not None:
+            writer = decodeCache.writer(fileName)
+        try:
+            if decodeProcesses is not None and decodeProcesses > 1:
+                # Decoding in parallel yields the whole file as a single block
+                self.progress.emit(total, 0, 'Decoding binary data with {} '
+                                   .format(decodeProcesses) + 'processes')
+                columns = hkdecoder.decodeParallel(fileName, decodeProcesses,
+                                                   report=report)
+                if writer is not None:
+                    writer.add(columns)
+                yield self.toDates(columns)
+            else:
+                with hkdecoder.mappedFile(fileName) as fileContents:
+                    for columns in hkdecoder.iterBlocks(fileContents,
+                                                        report=report):
+                        decoded = report.recordsDecoded
+                        self.progress.emit(
+                            total, min(decoded, total),
+                            'Reading binary data (record {} of {})'
+                            .format(decoded, total))
+                        if writer is not None:
+                            writer.add(columns)
+                        yield self.toDates(columns)
+            logging.info('{}: {}'.format(fileName, report.summary()))
+
+            if writer is not None:
+                self.progress.emit(total, total, 'Caching decoded data')
+                writer.close()
+        finally:
+            if writer is not None:
+                writer.discard()
+        self.done.emit()
 
-                logging.info('{:40s}: {}-{} {:10} {:10}'
-                             .format(sensorName, start, end - 1,
-                                     rawin.__repr__(), rawout))
-                if sensorName == 'Line terminator':
-                    if rawin != '\n':
-                        logging.error('Expected line break at bytes {} to {}.'
-                                      .format(start, end - 1) +
-                                      ' Got {} instead.\n'.format(rawout) +
-                                      'Discarding data since last line break' +
-                                      ' and skipping to the next one.\n' +
-                                      'Discarded data:\n{}'.format(lineData))
-                        skip = fileContents[end:].find('\n')
-                        start = end + skip + 1
-                        lineData = []
-                        break
-                start = end
 
-                # This will only work reliably if the timestamp is the first
-                # value after a line terminator
-                if sensorName == 'Timestamp':
-                    time = mpl.dates.epoch2num(rawout)
-                    continue
-                if sensorName in ['Line terminator', 'Status']:
-                    continue
+    def blocksFromFiles(self, fileNames):
+        """
+        Reads any number of journald log files. A single file is read by
+        `blocksFromFile`. Several files are decoded concurrently by a pool of
+        `decodeProcesses` worker processes (one per CPU by default), one
+        file per task, and yielded in order of completion. Raw beacon
+        archives and files found in `decodeCache` are yielded first.
 
-                try:
-                    time
-                except NameError:
-                    logging.critical("Data was discarded due to lack of a " +
-                                     "timestamp. This might have led to " +
-                                     "wrong timestamps for other data. Be " +
-                                     "careful when interpreting this data.")
-                if interpFunc is None:
-                    lineData.append([sensorName, time, rawout])
-                else:
-                    lineData.append([sensorName, time, interpFunc(rawout)])
-            data.append(lineData)
+        Receives:
+            list        fileNames   Files to be read
+        Yields:
+            dict        data        Interpreted temperature data of one block
+                                    or file in the format provided by
+                                    `toDates`
+        """
+        global decodeProcesses
+        global decodeTrace
+        global decodeCache
+
+        if len(fileNames) == 1:
+            for data in self.blocksFromFile(fileNames[0]):
+                yield data
+            return
+
+        total = len(fileNames)
+        self.track.emit()
+        missing = []
+        for fileName in fileNames:
+            columns = None
+            if hkarchive.isArchive(fileName):
+                columns = hkarchive.readColumns(fileName)
+            elif decodeCache is not None:
+                columns = decodeCache.load(fileName)
+            if columns is None:
+                missing.append(fileName)
+            else:
+                yield self.toDates(columns)
+        done = total - len(missing)
+        self.progress.emit(total, done, 'Decoding {} files'
+                           .format(len(missing)))
+
+        report = hkdecoder.DecodeReport(traceEvery=decodeTrace)
+        for fileName, columns, fileReport in hkdecoder.iterDecodeFiles(
+                missing, decodeProcesses, traceEvery=decodeTrace):
+            logging.info('{}: {}'.format(fileName, fileReport.summary()))
+            report.merge(fileReport)
+            if decodeCache is not None:
+                decodeCache.store(fileName, columns)
+            done += 1
+            self.progress.emit(total, done, 'Decoded {} ({} of {})'
+                               .format(ntpath.basename(fileName), done,
+                                       total))
+            yield self.toDates(columns)
+        logging.info('{} files: {}'.format(len(missing), report.summary()))
         self.done.emit()
-        return data
 
 
-    def dataFromFile(self, fileName):
+    def followFile(self, fileName):
         """
-        Reads a journald log file.
+        Loads the journald file `fileName` like in file mode and then keeps
+        decoding the complete records appended to it every `followInterval`
+        seconds. Only the bytes after the last decoded record are read. New
+        records are ushered through `refresh_feed` just like live beacons.
 
         Receives:
-            string      fileName    File to be read
+            string      fileName    File to be followed
         Returns:
-            list        data        Interpreted temperature data as
-                                    provided by `interpretTHM`
-        """
-        # This was adapted from OPS_housekeeping thm_processor
-        with open(fileName, 'rb') as f:
-            fileContents = f.read()
-        data = self.convert(fileContents)
-        # This was used to read plain text files
-        #data = []
-        #with open(file, 'r') as f:
-        #    for line in f.readlines():
-        #        line = line.split()
-        #        data.append(self.interpretTHM(line, stringify=False))
-        return data
+            None
+        """
+        global decodeTrace
+
+        report = hkdecoder.DecodeReport(traceEvery=decodeTrace)
+        with hkdecoder.mappedFile(fileName) as fileContents:
+            blocks = [self.toDates(columns) for columns
+                      in hkdecoder.iterBlocks(fileContents, report=report,
+                                              growing=True)]
+        self.processFileData(blocks)
+        logging.info('Following {} from byte {}'.format(fileName, report.end))
+
+        recordSize = hkdecoder.recordDtype().itemsize
+        while True:
+            time.sleep(self.followInterval)
+            # Anything shorter than a record cannot be a new complete one
+            if os.path.getsize(fileName) < report.end + recordSize:
+                continue
+            with hkdecoder.mappedFile(fileName) as fileContents:
+                for columns in hkdecoder.iterBlocks(fileContents,
+                                                    report=report,
+                                                    start=report.end,
+                                                    growing=True):
+                    feed = self.toFeed(self.toDates(columns))
+                    if feed:
+                        self.emit(SIGNAL('refresh_feed(PyQt_PyObject)'), feed)
+
+
+    @staticmethod
+    def toFeed(data):
+        """
+        Converts per-sensor columns to the [sensor, time, value] list format
+        of live beacons.
+        """
+        feed = []
+        for sensor, (x, y) in data.items():
+            feed.extend([sensor, _x, _y]
+                        for _x, _y in zip(x.tolist(), y.tolist()))
+        return feed
 
 
     def run(self):
@@ -545,8 +868,10 @@ class updateThread(QtCore.QThread):
 
         If in live mode, this function receives stdin messages and ushers
         a signal to trigger plotting of the new data. If in file mode, it reads
-        the specified file using `dataFromFile` and delegates the data to
-        `processFileData` for plotting.
+        the specified files using `blocksFromFiles` and delegates the data to
+        `processFileData` for plotting. If in follow mode, it additionally
+        keeps feeding records appended to the file to the live plots (see
+        `followFile`).
 
         Receives:
             None
@@ -555,10 +880,14 @@ class updateThread(QtCore.QThread):
         """
         global mode
         global fileMode
+        global fileNames
+        global followMode
 
+        if fileMode and followMode:
+            self.followFile(fileNames[0])
+            return
         if fileMode:
-            data = self.dataFromFile(mode)
-            self.processFileData(data)
+            self.processFileData(self.blocksFromFiles(fileNames))
             return
 
         while True:
@@ -1137,6 +1466,51 @@ class AverageDialog(QtGui.QDialog):
 ##############################################################################
 # Core Classes
 ##############################################################################
+class RenderScheduler(QtCore.QObject):
+    """
+    Decouples rendering from data ingest. Render requests may arrive at any
+    rate; they are coalesced and served by a single-shot Qt timer at most
+    `fps` times per second. Requests that arrive while a frame is already
+    pending are counted as dropped frames.
+    """
+    def __init__(self, render, fps):
+        """
+        Receives:
+            callable    render  Draws a frame
+            float       fps     Maximum number of frames per second
+        """
+        super(RenderScheduler, self).__init__()
+        self.render = render
+        self.interval = 1 / fps
+        self.framesRendered = 0
+        self.framesDropped = 0
+        self.lastFrame = 0
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.onTimeout)
+
+
+    def request(self):
+        """
+        Requests a frame, which is rendered as soon as the frame rate allows.
+        """
+        if self.timer.isActive():
+            self.framesDropped += 1
+            return
+        wait = self.lastFrame + self.interval - time.time()
+        self.timer.start(max(0, int(wait * 1000)))
+
+
+    def onTimeout(self):
+        self.lastFrame = time.time()
+        self.framesRendered += 1
+        self.render()
+        logging.debug('Rendered frame {} in {:.3f} s ({} dropped so far)'
+                      .format(self.framesRendered,
+                              time.time() - self.lastFrame,
+                              self.framesDropped))
+
+
 class Window(QtCore.QObject):
     global mode
     global fileMode
@@ -1144,6 +1518,9 @@ class Window(QtCore.QObject):
     track = pyqtSignal()
     doneSig = pyqtSignal()
 
+    # Seconds between snapshots of the live data
+    snapshotInterval = 60
+
     def __init__(self, gui):
         super(Window, self).__init__()
         self.fig = Figure()
@@ -1155,14 +1532,23 @@ class Window(QtCore.QObject):
 
         self.sensors = []
         self.spikes = []
-        self.dups = []
+        self.conflicts = hkseries.ConflictReport()
         self.dupLines = []
         self.graphs = {}
+        self.graphStyles = {}
         self.colors = {}
         self.data = {}
         self.compareAx = None
         self.compareLims = None
         self.marker = '+'
+        # Background of the live graphs and the view it was cached for
+        self.background = None
+        self.backgroundKey = None
+        # Decides when the live view moves
+        self.view = hkview.LiveView()
+        # Sensors that received data since the last frame
+        self.dirty = set()
+        self.scheduler = RenderScheduler(self.render, renderFps)
 
         self.ax.xaxis_date()
         self.updateTicks()
@@ -1172,12 +1558,34 @@ class Window(QtCore.QObject):
 
         self.updateThread = updateThread()
         self.freqThread = DataFrequencyThread(gui, self.updateThread)
+        # Live data of every feed passes through the steady state detection,
+        # so its thread runs from the start
+        self.steadyThread = SteadyStateThread(gui.steadyStateThreshold,
+                                              gui.steadyStateTimeRange)
+        self.steadyThread.start()
+        self.snapshotThread = SnapshotThread(hksnapshot.snapshotFile(mode))
+        self.snapshotTimer = QtCore.QTimer()
+        self.snapshotTimer.timeout.connect(self.takeSnapshot)
+        if not (fileMode or mode == 'simulation'):
+            # The live data of every mode but the simulation is snapshotted,
+            # each mode to its own file
+            self.snapshotThread.start()
+            self.snapshotTimer.start(self.snapshotInterval * 1000)
+        # Live data restored from the last snapshot of the mode (command
+        # line option --resume), until it is plotted
+        self.resumed = None
+        if resumeMode and not (fileMode or mode == 'simulation'):
+            self.resumed = hksnapshot.load(mode)
         self.gui = gui
         self.fig.canvas.mpl_connect('motion_notify_event', self.onMove)
         self.fig.canvas.mpl_connect('button_release_event', self.onRelease)
+        self.fig.canvas.mpl_connect('draw_event', self.onDraw)
         self.connect(self.gui.consumer,
-                     SIGNAL('refresh_feed(PyQt_PyObject)'),
-                     self.update)
+                     SIGNAL('refresh_batch(PyQt_PyObject)'),
+                     self.updateBatch)
+        if self.resumed:
+            # Plotted once the GUI is complete, without waiting for a beacon
+            QtCore.QTimer.singleShot(0, self.showResumed)
 
 
     def updateAverage(self, points, method):
@@ -1352,19 +1760,12 @@ class Window(QtCore.QObject):
             None
         """
         xmin, xmax = ax.xaxis.get_view_interval()
-        data = []
-        for line in ax.lines:
-            isSetting = str(line.get_label()) == 'setting'
-            if line.get_visible() and not isSetting:
-                xdata = line.get_xdata()
-                ydata = line.get_ydata()
-                filtered = ydata[np.where(xmin <= xdata & xdata <= xmax)]
-                data.append(list(filtered))
-
-        data = [float(item) for sublist in data for item in sublist]
-        if len(data) == 0:
+        lines = [line for line in ax.lines
+                 if line.get_visible() and str(line.get_label()) != 'setting']
+        extents = self.lineExtents(lines, xmin, xmax)
+        if extents is None or np.isnan(extents[2]):
             return
-        miny, maxy = [min(data), max(data)]
+        miny, maxy = extents[2:]
 
         if miny > 0:
             miny *= 0.95
@@ -1453,6 +1854,9 @@ class Window(QtCore.QObject):
             self.gui.toolbar.release_zoom(event)
         elif self.gui.toolbar._active == 'PAN':
             self.gui.toolbar.release_pan(event)
+        elif self.backgroundKey == self.viewKey():
+            # Nothing changed, the cached background is still up to date
+            return
         self.updateTicks()
         # This is necessary so ticks will be refreshed after releasing
         # mouse -.-
@@ -1486,6 +1890,20 @@ class Window(QtCore.QObject):
         self.canvas.draw()
 
 
+    def toEpoch(self, timestamp):
+        """
+        Converts a beacon timestamp as accepted by `str2mpldate` to seconds
+        since epoch, without converting its time zone.
+        """
+        if fileMode or mode == 'simulation':
+            return float(mpl.dates.num2epoch(timestamp))
+        if type(timestamp).__name__ != 'datetime':
+            timestamp = datetime.datetime.strptime(timestamp,
+                                                   '%Y-%m-%dT%H:%M:%S')
+        return calendar.timegm(timestamp.timetuple()) + \
+            timestamp.microsecond / 1e6
+
+
     def str2mpldate(self, str):
         if fileMode or mode == 'simulation':
             # str should already be a mpl date in this case
@@ -1504,6 +1922,7 @@ class Window(QtCore.QObject):
     def initGraphs(self, data):
         logging.info("Initializing graphs")
         self.graphs = {}
+        self.graphStyles = {}
 
         for sensorData in data:
             sensor = sensorData[0]
@@ -1607,6 +2026,19 @@ class Window(QtCore.QObject):
         self.freqThread.start()
 
 
+    def takeSnapshot(self):
+        """
+        Copies the live data and leaves writing it to `snapshotThread`.
+        """
+        global globalData
+
+        if not globalData:
+            return
+        if not self.snapshotThread.add(hksnapshot.capture(globalData, mode)):
+            logging.warning('Skipped a snapshot, the previous one is still '
+                            'being written')
+
+
     def done(self):
         logging.info("Data retrieval stopped")
 
@@ -1637,7 +2069,11 @@ class Window(QtCore.QObject):
 
 
     def markDuplicates(self):
-        for x in self.dups:
+        """
+        Marks the timestamps at which loaded files disagree on the value of
+        a sensor with vertical lines (see `hkseries.ConflictReport`).
+        """
+        for x in self.conflicts.times():
             self.dupLines.append(self.ax.axvline(x, 0, 1,
                                                  color='grey',
                                                  ls='--'))
@@ -1654,6 +2090,7 @@ class Window(QtCore.QObject):
     def plotAll(self, plotData):
         """ Plots all data from a file instantly """
         self.ax.clear()
+        self.graphStyles = {}
 
         self.sensors = [Sensor(name) for name in sorted(plotData.keys())]
         uniqueSubsystems = list(set([s.subsystem for s in self.sensors]))
@@ -1685,73 +2122,233 @@ class Window(QtCore.QObject):
         self.canvas.draw()
 
 
+    def liveSeries(self, x=None, y=None):
+        """
+        Creates the store of a sensor's live data. Samples older than
+        `retentionHours` (command line option --retention=N) are rolled up
+        into 1-minute and later 1-hour bins (see `hkseries.RetainedSeries`).
+        """
+        global retentionHours
+        return hkseries.RetainedSeries(x, y, fullHours=retentionHours)
+
+
     def _appendBeaconData(self, data, newData):
-        global rawtime
-        global rawdata
+        """
+        Appends samples in the [sensor, time, value] list format of single
+        beacons, see `_appendColumns`.
+        """
+        sensors = []
+        sensorIds = {}
+        ids = []
+        times = []
+        epochs = []
+        values = []
         for sensorData in newData:
             sensor = str(sensorData[0])
-            if sensor not in rawtime:
-                rawtime[sensor] = []
-                rawdata[sensor] = []
-            rawtime[sensor].append(sensorData[1])
-            rawdata[sensor].append(sensorData[2])
+            if sensor not in sensorIds:
+                sensorIds[sensor] = len(sensors)
+                sensors.append(sensor)
+            ids.append(sensorIds[sensor])
+            times.append(self.str2mpldate(sensorData[1]))
+            epochs.append(self.toEpoch(sensorData[1]))
+            values.append(sensorData[2])
+        return self._appendColumns(data, sensors, np.array(ids, dtype=int),
+                                   np.array(times, dtype=float),
+                                   np.array(epochs, dtype=float), values)
+
+
+    def _appendColumns(self, data, sensors, ids, times, epochs, values):
+        """
+        Appends samples given as columns to the live data, and their raw
+        values to `rawArchive`. The samples are grouped by sensor with one
+        stable sort, and each sensor's samples are merged in one call.
 
+        Receives:
+            dict        data    Live data
+            list        sensors Sensor names, indexed by `ids`
+            numpy array ids     Sensor of every sample
+            numpy array times   Timestamps (matplotlib dates)
+            numpy array epochs  Raw timestamps (seconds since epoch)
+            list        values  Raw values
+        Returns:
+            dict        data    Live data
+        """
+        global rawArchive
+        values = self.toValues(sensors, ids, values)
+        rawArchive.addColumns(sensors, ids, epochs, values)
+
+        order = ids.argsort(kind='mergesort')
+        ids = ids[order]
+        times = times[order]
+        values = values[order]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        samples = {}
+        for start, end in zip(starts, np.r_[starts[1:], ids.size]):
+            sensor = sensors[ids[start]]
             if sensor == 'THM System State':
                 continue
-            time = self.str2mpldate(sensorData[1])
-            value = float(sensorData[2])
-
             if sensor not in data:
-                data[sensor] = [[], []]
-            data[sensor][0].append(time)
-            data[sensor][1].append(value)
+                data[sensor] = self.liveSeries()
+            samples[sensor] = hkseries.sortSeries(times[start:end],
+                                                  values[start:end])
+            data[sensor].merge(*samples[sensor])
+        self.steadyThread.add(samples)
+
+        return data
+
+
+    @staticmethod
+    def toValues(sensors, ids, values):
+        """
+        Converts raw values to a float array. Values that cannot be converted
+        become NaN.
+        """
+        if isinstance(values, np.ndarray):
+            return values.astype(float)
+        try:
+            return np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            pass
+        converted = np.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                converted[i] = float(value)
+            except (TypeError, ValueError):
+                logging.error('Non-numeric value {!r} of {}'
+                              .format(value, sensors[ids[i]]))
+                converted[i] = np.nan
+        return converted
 
-            # Sort by time
-            times = data[sensor][0]
-            values = data[sensor][1]
 
-            times, values = zip(*sorted(zip(times, values)))
+    def seedLiveData(self):
+        """
+        In follow mode, the live data continues the data loaded from file,
+        with --resume the data of the last snapshot.
+        """
+        global globalData
 
-            data[sensor][0] = list(times)
-            data[sensor][1] = list(values)
+        if globalData or not (fileMode or self.resumed):
+            return
+        if fileMode:
+            globalData = dict((sensor, self.liveSeries(x, y))
+                              for sensor, (x, y) in self.data.items())
+        else:
+            globalData = self.resumed
+            self.resumed = None
+        self.dirty.update(globalData)
+        timeRange = self.gui.steadyStateTimeRange
+        self.steadyThread.configure(self.gui.steadyStateThreshold,
+                                    timeRange,
+                                    self.steadyHistory(timeRange))
 
-        logger.info('{}'.format(datetime.datetime.now()))
-        logger.info(rawtime)
-        logger.info(rawdata)
-        logger.info('\n\n')
 
-        return data
+    def showResumed(self):
+        """
+        Plots the live data restored from the snapshot (see `seedLiveData`).
+        """
+        global globalData
+
+        if not self.resumed:
+            return
+        self.seedLiveData()
+        if len(self.graphs) == 0:
+            # The last sample of each sensor stands in for a single beacon,
+            # with its time in the format of `str2mpldate`
+            shift = datetime.timedelta(hours=self.gui.timeZone)
+            self.initGraphs([[sensor, mpl.dates.num2date(series.x[-1])
+                              .replace(tzinfo=None) - shift, series.y[-1]]
+                             for sensor, series in sorted(globalData.items())
+                             if len(series)])
+        self.scheduler.request()
+
+
+    def checkSystemState(self, state):
+        """
+        Displays a warning if the system state `state` is a warning state.
+        """
+        if state == 1:
+            logging.warning('SYSTEM IN WARNING STATE')
+            self.gui.warning(state)
+        elif state == 2:
+            logging.warning('!!!!!! SYSTEM IN CRITICAL STATE !!!!!!')
+            self.gui.warning(state)
 
 
     def update(self, data, live=True):
         """
-        Append data and re-draw canvas. This method is only invoked in live
-        mode.
+        Append data and schedule a re-draw of the canvas. The sensors that
+        received data are marked dirty; drawing them is left to `render`,
+        which `scheduler` runs at most `renderFps` times per second (command
+        line option --fps=N), no matter how fast beacons arrive. This method
+        is only invoked in live mode.
         """
         global globalData
 
+        self.seedLiveData()
+
         # Display warning if warning state
         for sensorData in data:
             sensor = sensorData[0]
-            if sensor in ('THM System State', 'State', 'System State'):
-                newy = sensorData[2]
-                if newy == 1:
-                    logging.warning('SYSTEM IN WARNING STATE')
-                    self.gui.warning(newy)
-                elif newy == 2:
-                    logging.warning('!!!!!! SYSTEM IN CRITICAL STATE !!!!!!')
-                    self.gui.warning(newy)
+            if sensor in hksteady.STATE_SENSORS:
+                self.checkSystemState(sensorData[2])
                 break
 
         if len(self.graphs) == 0:
             self.initGraphs(data)
 
         globalData = self._appendBeaconData(globalData, data)
+        self.dirty.update(str(sensorData[0]) for sensorData in data)
+
+        if live:
+            self.scheduler.request()
+
+
+    def updateBatch(self, batch):
+        """
+        Like `update`, but for the beacons received by the consumer, which
+        arrive in batches (see `hkbeacon.BeaconBatch`). The timestamps of
+        the whole batch are converted at once.
+        """
+        global globalData
 
+        if not len(batch):
+            return
+        self.seedLiveData()
+
+        # Display warning if the latest system state is a warning state
+        states = [i for i, sensor in enumerate(batch.sensors)
+                  if sensor in hksteady.STATE_SENSORS]
+        isState = np.isin(batch.ids, states)
+        if isState.any():
+            self.checkSystemState(batch.values[isState][-1])
+
+        if len(self.graphs) == 0:
+            # The first sample of each sensor stands in for a single beacon
+            feed = batch.feed()
+            first = np.unique(batch.ids, return_index=True)[1]
+            self.initGraphs([feed[i] for i in first])
+
+        # The same conversion as `str2mpldate`
+        times = (mpl.dates.epoch2num(batch.timestamps) +
+                 self.gui.timeZone / 24)
+        globalData = self._appendColumns(globalData, batch.sensors,
+                                         batch.ids, times, batch.timestamps,
+                                         batch.values)
+        self.dirty.update(batch.sensors[i] for i in np.unique(batch.ids))
+        self.scheduler.request()
+
+
+    def render(self):
+        """
+        Draws the sensors marked dirty by `update` since the last frame and
+        adjusts the view.
+        """
+        global globalData
+
+        dirty = self.dirty
+        self.dirty = set()
         selectedSensors = self.getSelectedSensors()
 
-        xtot = []
-        ytot = []
         oldxLim = self.ax.get_xlim()
         oldyLim = self.ax.get_ylim()
         fixedView = not self.gui.cbAutoUpdate.isChecked()
@@ -1761,21 +2358,14 @@ class Window(QtCore.QObject):
             xLimit = None
 
         for sensor, sensorData in globalData.items():
-            times, values = sensorData
             selected = sensor in selectedSensors
-            graph = self.graphs[sensor]
-
-            if live:
-                self.checkSteadyState(sensor, times, values)
-
-            # This might lead to problems if the program has been running for
-            # a long time and xtot gets huge. Consider reducing it to unique
-            # values
-            xtot.extend(times)
-            ytot.extend(values)
 
-            logging.debug("Current data for {}:".format(sensor))
-            logging.debug(list(zip(times, values)))
+            graph = self.graphs.get(sensor)
+            if sensor not in dirty:
+                if graph is not None and graph.get_visible() != selected:
+                    graph.set_visible(selected)
+                continue
+            times, values = sensorData
 
             # Show current temperature values
             # This has to happen after the arrays were chronologically sorted
@@ -1786,66 +2376,167 @@ class Window(QtCore.QObject):
             except:
                 pass
 
-            try:
-                graph.remove()
-            except:
-                pass
-            marker = self.marker
-            if self.gui.cbShowLines.isChecked():
-                graph = self.ax.plot_date(times, values,
-                                          color=self.colors[sensor],
-                                          marker=marker,
-                                          ls='solid')[0]
-            else:
-                graph = self.ax.plot_date(times, values,
-                                          color=self.colors[sensor],
-                                          marker=None,
-                                          ls='none')[0]
+            graph = self.updateGraph(sensor, times, values)
+            if graph.get_visible() != selected:
+                graph.set_visible(selected)
 
-            if not selected:
-                graph.set_visible(False)
-
-            self.graphs[sensor] = graph
-
-        # Adjust view
+        # Adjust view. The limits only move once new data leaves the view, so
+        # that most beacons can be blitted onto the cached background
         if fixedView:
             self.ax.set_xlim(oldxLim)
             self.ax.set_ylim(oldyLim)
         else:
-            if min(xtot) == max(xtot):
-                date = mpl.dates.num2date(max(xtot))
-                padLeft = datetime.timedelta(minutes=5)
-                padRight = datetime.timedelta(minutes=1)
-                self.ax.set_xlim(date - padLeft, date + padRight)
-            else:
-                maxDate = mpl.dates.num2date(max(xtot))
-                xmin = mpl.dates.num2date(self.ax.get_xlim()[0])
-                if xLimit:
-                    range = maxDate - xmin
-                    minutes = xLimit
-                    xLimit = datetime.timedelta(minutes=minutes)
-                    if range > xLimit:
-                        maxDate += datetime.timedelta(minutes=minutes / 10)
-                        self.ax.set_xlim([maxDate - xLimit, maxDate])
-                    else:
-                        try:
-                            padRight = (maxDate - xmin) / 20
-                        except TypeError:
-                            padRight = datetime.timedelta(minutes=5)
-                        self.ax.set_xlim(xmin, maxDate + padRight)
-                else:
-                    try:
-                        padRight = (maxDate - xmin) / 20
-                    except TypeError:
-                        padRight = datetime.timedelta(minutes=5)
-                    self.ax.set_xlim(xmin, maxDate + padRight)
+            limits = self.view.adjust(globalData, oldxLim, oldyLim, xLimit)
+            if limits is not None:
+                self.ax.set_xlim(limits[0])
+                self.ax.set_ylim(limits[1])
 
         if self.gui.sensorTable.rowCount() == 0:
             self.gui.populateSensorTable(self.sensors)
 
-        if live:
+        self.redraw()
+
+
+    def lineExtents(self, lines, left=None, right=None):
+        """
+        Finds the combined extents of the data of `lines` within the time
+        range from `left` to `right` (see `hkseries.extents`). Sensor graphs
+        that show the stored data of their sensor, i.e. that are not averaged
+        or shifted, are answered from the running extrema of the store.
+        Other lines are searched with `searchsorted`.
+
+        Receives:
+            list        lines   Line2D objects with data sorted by time
+            float       left    Start of the time range. Default: unbounded
+            float       right   End of the time range. Default: unbounded
+        Returns:
+            tuple       extents (xmin, xmax, ymin, ymax) or None if there is
+                                no data in range
+        """
+        global globalData
+
+        store = globalData or self.data
+        sensors = dict((graph, sensor)
+                       for sensor, graph in self.graphs.items())
+        allExtents = []
+        for line in lines:
+            x = line.get_xdata()
+            y = line.get_ydata()
+            series = store.get(sensors.get(line))
+            if (series is not None and len(x) == len(series) and len(x) and
+                    x[0] == series.x[0] and x[-1] == series.x[-1]):
+                allExtents.append(hkseries.extents(series, left, right))
+            else:
+                allExtents.append(hkseries.extents((x, y), left, right))
+        return hkseries.combineExtents(allExtents)
+
+
+    def viewKey(self):
+        """
+        Returns what the cached background depends on: the axes limits and
+        the size of the figure.
+        """
+        return (tuple(self.ax.get_xlim()), tuple(self.ax.get_ylim()),
+                tuple(self.fig.bbox.bounds))
+
+
+    def onDraw(self, event):
+        """
+        Caches the background after every full draw of the canvas, then draws
+        the animated live graphs on top of it.
+        """
+        global blitMode
+
+        if not blitMode:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.backgroundKey = self.viewKey()
+        self.drawGraphs()
+
+
+    def drawGraphs(self):
+        """
+        Draws the visible animated graphs, which are left out of full draws.
+        """
+        lines = self.ax.lines
+        for graph in self.graphs.values():
+            if graph.get_animated() and graph.get_visible() and graph in lines:
+                self.ax.draw_artist(graph)
+
+
+    def redraw(self):
+        """
+        Redraws the canvas after a live update. If `blitMode` is set
+        (disable with command line option --no-blit), only the live graphs
+        are drawn onto the background cached by `onDraw`, and the result is
+        blitted to the screen. Axes, ticks and grid are only drawn again,
+        along with everything else, if the limits or the size of the figure
+        changed since the background was cached.
+
+        Receives:
+            None
+        Returns:
+            None
+        """
+        global blitMode
+
+        if (not blitMode or self.background is None or
+                self.backgroundKey != self.viewKey()):
             self.updateTicks()
             self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.drawGraphs()
+        self.canvas.blit(self.ax.bbox)
+
+
+    def graphStyle(self, sensor):
+        """
+        Returns the style the live graph of `sensor` should have according to
+        the current settings.
+        """
+        style = {'color': tuple(self.colors[sensor])}
+        if self.gui.cbShowLines.isChecked():
+            style.update(marker=self.marker, linestyle='solid')
+        else:
+            style.update(marker=None, linestyle='none')
+        return style
+
+
+    def updateGraph(self, sensor, times, values):
+        """
+        Shows the current data of `sensor` in its live graph. The graph is
+        kept from beacon to beacon and updated in place with `set_data`. It
+        is only created if it does not exist yet or was removed from the
+        axes, and its style is only re-applied if it changed since it was
+        last applied (see `graphStyle`). In `blitMode`, the graph is animated,
+        i.e. drawn by `drawGraphs` instead of by full draws.
+
+        Receives:
+            string      sensor  Name of the sensor
+            numpy array times   Timestamps (matplotlib dates)
+            numpy array values  Values
+        Returns:
+            Line2D      graph   The sensor's graph
+        """
+        global blitMode
+
+        graph = self.graphs.get(sensor)
+        style = self.graphStyle(sensor)
+        if graph is None or graph not in self.ax.lines:
+            graph = self.ax.plot_date(times, values, **style)[0]
+            graph.set_animated(blitMode)
+            self.graphs[sensor] = graph
+        else:
+            if graph.get_animated() != blitMode:
+                # Graphs created by `initGraphs` or `plotAll`
+                graph.set_animated(blitMode)
+            graph.set_data(times, values)
+            if self.graphStyles.get(sensor) == style:
+                return graph
+            mpl.artist.setp(graph, **style)
+        self.graphStyles[sensor] = style
+        return graph
 
 
     def getSensor(self, sensorName):
@@ -1858,32 +2549,22 @@ class Window(QtCore.QObject):
         return sensor
 
 
-    def checkSteadyState(self, sensor, times, data):
-        times = [mpl.dates.num2date(time) for time in times]
-        threshold = self.gui.steadyStateThreshold
-        dt = datetime.timedelta(minutes=self.gui.steadyStateTimeRange)
-        inSteadyState = self.getSensor(sensor).steady
-        y = []
-
-        if sensor in ('THM System State', 'State', 'System State'):
-            return
-        for _time, _y in zip(times, data):
-            if max(times) - dt < _time <= max(times):
-                y.append(_y)
+    def steadyHistory(self, timeRange):
+        """
+        Returns the samples of the last `timeRange` minutes of every sensor,
+        which is all the steady state detection needs to start over.
+        """
+        global globalData
 
-        try:
-            if abs(min(y) - max(y)) < threshold:
-                if not inSteadyState:
-                    self.emit(SIGNAL(
-                        'steady_state_changed(PyQt_PyObject, PyQt_PyObject)'),
-                        sensor, True)
-            else:
-                if inSteadyState:
-                    self.emit(SIGNAL(
-                        'steady_state_changed(PyQt_PyObject, PyQt_PyObject)'),
-                        sensor, False)
-        except ValueError:
-            pass
+        history = {}
+        for sensor, series in globalData.items():
+            x, y = series
+            if len(x) == 0:
+                continue
+            start = np.searchsorted(x, x[-1] - timeRange * hksteady.MINUTE,
+                                    side='right')
+            history[sensor] = (x[start:], y[start:])
+        return history
 
 
     def updateTicks(self, xmin=None, xmax=None):
@@ -2038,8 +2719,11 @@ class Window(QtCore.QObject):
         self.canvas.draw()
         self.data = {}
         self.graphs = {}
+        self.graphStyles = {}
         self.sensors = []
         self.colors = {}
+        self.conflicts = hkseries.ConflictReport()
+        self.view = hkview.LiveView()
 
         if restart:
             self.goLive()
@@ -2048,6 +2732,7 @@ class Window(QtCore.QObject):
 
 class Monitor(QMainWindow, Ui_MainWindow):
     global fileMode
+    global followMode
 
     def __init__(self):
         super(Monitor, self).__init__()
@@ -2056,14 +2741,14 @@ class Monitor(QMainWindow, Ui_MainWindow):
         global __version__
 
         self.consumer = ConsumerThread()
+        self.steadyStateThreshold = 0.5
+        self.steadyStateTimeRange = 60
         self.createWindow()
 
         self.toolbar = NavigationToolbar(self.window.canvas, self)
         self.toolbar.hide()
         self.toolbar.pan()
 
-        self.steadyStateThreshold = 0.5
-        self.steadyStateTimeRange = 60
         self.timeZone = 0
         self._points = 2
         self._averageMethod = 'mean'
@@ -2077,12 +2762,12 @@ class Monitor(QMainWindow, Ui_MainWindow):
         self.statusTimeZone = QtGui.QLabel()
         self.statusSteadyState = QtGui.QLabel()
         self.statusFrequency.setMinimumWidth(600)
-        if not fileMode:
+        if not fileMode or followMode:
             self.statusbar.addPermanentWidget(self.statusSteadyState)
             self.statusbar.addPermanentWidget(self.statusFrequency)
         self.statusbar.addPermanentWidget(self.statusTimeZone)
         self.updateTimeZoneText()
-        if not fileMode:
+        if not fileMode or followMode:
             self.updateSteadyStateText()
 
         self.progressbar = QtGui.QProgressBar()
@@ -2143,7 +2828,7 @@ class Monitor(QMainWindow, Ui_MainWindow):
         self.menuOnlineDoc.triggered.connect(
             functools.partial(self.openLink, link))
 
-        if not fileMode:
+        if not fileMode or followMode:
             self.menuChangeSteadyState.triggered.connect(
                 self.changeSteadyStateDefinition)
             self.menuAddData.setEnabled(False)
@@ -2162,9 +2847,10 @@ class Monitor(QMainWindow, Ui_MainWindow):
                 self.removeDuplicateMarkers)
             self.menuChangeSteadyState.setEnabled(False)
 
-        if not fileMode:
+        if not fileMode or followMode:
             signal = 'steady_state_changed(PyQt_PyObject, PyQt_PyObject)'
-            self.connect(self.window, SIGNAL(signal), self.applySteadyState)
+            self.connect(self.window.steadyThread, SIGNAL(signal),
+                         self.applySteadyState)
             signal = 'beacon_gap_event(PyQt_PyObject)'
             self.connect(self.window.freqThread, SIGNAL(signal),
                          self.logMissingBeacon)
@@ -2205,20 +2891,17 @@ class Monitor(QMainWindow, Ui_MainWindow):
                                 "Written by: Amazigh Zerzour\n" +
                                 "E-mail: amazigh.zerzour@gmail.com ")
 
-    @staticmethod
-    def getExtrema(lines):
-        y = []
-        for line in lines:
-            if line.get_visible():
-                y.extend(line.get_ydata())
-        if len(y) < 1:
+    def getExtrema(self, lines):
+        extents = self.window.lineExtents([line for line in lines
+                                           if line.get_visible()])
+        if extents is None or np.isnan(extents[2]):
             return [None, None]
-        return [min(y), max(y)]
+        return list(extents[2:])
 
 
-    def receiveDuplicates(self, dups):
-        self.window.dups.extend(dups)
-        self.window.dups = list(set(self.window.dups))
+    def receiveDuplicates(self, conflicts):
+        # The report covers all loaded data, so it replaces the previous one
+        self.window.conflicts = conflicts
 
 
     def markDuplicates(self):
@@ -2372,28 +3055,32 @@ class Monitor(QMainWindow, Ui_MainWindow):
 
     def addData(self, purge=False):
         """
-        Opens file dialog to choose file to read data from. Delegates file to
-        `updateThread` to retreive and plot data. Re-titles the window
-        according to what files are currently loaded.
+        Opens file dialog to choose one or more files to read data from.
+        Delegates the files to `updateThread` to retreive and plot data.
+        Re-titles the window according to what files are currently loaded.
 
         Receives:
             boolean     purge       Whether or not to retain existing data
         Returns:
             None
         """
-        file = QtGui.QFileDialog.getOpenFileName(self,
-                                                 caption='Load file')
-        file = str(file)
-        if os.path.isfile(file):
-            self.window.updateThread.add.emit(file, purge, self.window.data)
-
+        files = QtGui.QFileDialog.getOpenFileNames(self,
+                                                   caption='Load files')
+        files = [str(file) for file in files if os.path.isfile(str(file))]
+        if files:
+            self.window.updateThread.add.emit(files, purge, self.window.data)
+
+            if len(files) == 1:
+                name = ntpath.basename(files[0])
+            else:
+                name = '{} files'.format(len(files))
             title = str(self.windowTitle())
             hasFilenameInTitle = len(title.split('-')) > 1
             if hasFilenameInTitle:
                 if purge:
-                    title = title.split('-')[0] + ' - ' + ntpath.basename(file)
+                    title = title.split('-')[0] + ' - ' + name
                 else:
-                    title = title + ' + ' + ntpath.basename(file)
+                    title = title + ' + ' + name
             self.setWindowTitle(title)
 
 
@@ -2539,6 +3226,9 @@ class Monitor(QMainWindow, Ui_MainWindow):
         if ok:
             self.steadyStateThreshold = float(threshold)
             self.steadyStateTimeRange = float(timerange)
+            self.window.steadyThread.configure(
+                self.steadyStateThreshold, self.steadyStateTimeRange,
+                self.window.steadyHistory(self.steadyStateTimeRange))
             self.updateSteadyStateText()
         else:
             self.statusbar.showMessage('Did not set new definition', 5000)
@@ -2699,30 +3389,23 @@ class Monitor(QMainWindow, Ui_MainWindow):
 
 
     def zoom(self, toShow, ax=None):
-        xtot = []
-        ytot = []
-
         if ax is None:
             ax = self.window.ax
 
         visLines = self.getVisibleLines()
 
-        if len(visLines) == 0:
+        extents = self.window.lineExtents(visLines)
+        if extents is None or np.isnan(extents[2]):
             return
+        xmin, xmax, ymin, ymax = extents
 
-        for line in visLines:
-            x = line.get_xdata()
-            y = line.get_ydata()
-            xtot.extend(x)
-            ytot.extend(y)
+        ypad = abs(ymax - ymin) * 0.05
+        xpad = abs(xmax - xmin) * 0.05
 
-        ypad = abs(max(ytot) - min(ytot)) * 0.05
-        xpad = abs(max(xtot) - min(xtot)) * 0.05
-
-        xmin = min(xtot) - xpad
-        xmax = max(xtot) + xpad
-        ymin = min(ytot) - ypad
-        ymax = max(ytot) + ypad
+        xmin = xmin - xpad
+        xmax = xmax + xpad
+        ymin = ymin - ypad
+        ymax = ymax + ypad
 
         if toShow == 'all':
             self.window.updateTicks(xmin=xmin, xmax=xmax)
@@ -2940,7 +3623,7 @@ class Monitor(QMainWindow, Ui_MainWindow):
 
             cb.stateChanged.connect(self.togglePlots)
 
-            if not fileMode:
+            if not fileMode or followMode:
                 tip = ('<span style="color:black;">'
                        'Green = steady state reached</span>')
                 tempText.setToolTip(tip)
@@ -2958,6 +3641,11 @@ class Monitor(QMainWindow, Ui_MainWindow):
         table.setRowCount(rowCount)
         self.stopTrackingProgress()
 
+        # States detected before the table existed could not be highlighted
+        for sensor, steady in self.window.steadyThread.states().items():
+            if steady:
+                self.applySteadyState(sensor, True)
+
 
     def getSelectedSensors(self):
         return [sensor
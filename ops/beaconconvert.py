@@ -1,3 +1,5 @@
+import numpy as np
+
 def interpretDS18B20(raw_value):
     return float(((raw_value)/16.0))
 
@@ -28,3 +30,28 @@ def statusConverter(value):
         return values[value]
     except:
         return "UNKNOWN THM STATUS (" + str(value) + ")"
+
+
+# Lookup tables of the interpret functions above, computed on first use
+_lookupTables = {}
+
+def lookupTable(interpFunc):
+    """
+    Returns a 65536-entry table holding `interpFunc` evaluated for every raw
+    16-bit value. The table is indexed by the raw int16 reinterpreted as
+    uint16 and cached per interpret function.
+    """
+    if interpFunc not in _lookupTables:
+        rawValues = np.arange(65536, dtype=np.uint16).view(np.int16)
+        _lookupTables[interpFunc] = np.array(
+            [interpFunc(value) for value in rawValues.tolist()],
+            dtype=np.float64)
+    return _lookupTables[interpFunc]
+
+def interpretColumn(interpFunc, raw_values):
+    """
+    Applies `interpFunc` to a whole array of raw int16 values with a single
+    lookup. Gives the same results as calling `interpFunc` on every value.
+    """
+    raw_values = np.ascontiguousarray(raw_values, dtype=np.int16)
+    return lookupTable(interpFunc)[raw_values.view(np.uint16)]
@@ -0,0 +1,405 @@
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# File signature and format version
+MAGIC = b'HKRAWARC'
+VERSION = 1
+HEADER = struct.Struct('<8sH')
+
+# Block kinds. Every block starts with its kind
+SAMPLE = 0
+SENSOR = 1
+INDEX = 2
+
+# Kind, sensor ID, timestamp (seconds since epoch) and raw value
+SAMPLE_BLOCK = struct.Struct('<BHdd')
+SAMPLE_DTYPE = np.dtype([(str('kind'), '<u1'), (str('sensor'), '<u2'),
+                         (str('timestamp'), '<f8'), (str('value'), '<f8')])
+# Kind, sensor ID and length of the UTF-8 encoded sensor name, which follows
+SENSOR_BLOCK = struct.Struct('<BHH')
+# Kind, marker, number of samples since the previous index block, their
+# earliest and latest timestamp, offset of the first of them, offset of the
+# previous index block (or -1) and number of sensors. One SENSOR_ENTRY per
+# known sensor follows, each followed by the sensor's name
+INDEX_BLOCK = struct.Struct('<B8sIddqqH')
+INDEX_MARKER = b'HKRAWIDX'
+SENSOR_ENTRY = struct.Struct('<HH')
+
+# Samples between two index blocks
+INDEX_INTERVAL = 4096
+
+# Bytes searched at a time for the last index block
+SEARCH_SIZE = 1024 * 1024
+
+
+def _encode(name):
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    return name
+
+
+def isArchive(fileName):
+    """
+    Checks whether `fileName` is a raw beacon archive.
+    """
+    try:
+        with open(fileName, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+class IndexBlock(object):
+    """
+    Index block of a raw beacon archive. It summarizes the samples written
+    since the previous index block (the span) and holds the names of all
+    sensors known so far, so that an archive can be read from the start of
+    any span.
+    """
+    def __init__(self, offset, end, count, first, last, spanStart, previous,
+                 sensors):
+        self.offset = offset
+        self.end = end
+        self.count = count
+        self.first = first
+        self.last = last
+        self.spanStart = spanStart
+        self.previous = previous
+        self.sensors = sensors
+
+
+def _readIndex(data, offset):
+    """
+    Parses the index block at `offset` of the archive contents `data`.
+    Returns None if there is no complete index block.
+    """
+    if offset + INDEX_BLOCK.size > len(data):
+        return None
+    (kind, marker, count, first, last, spanStart, previous,
+     numSensors) = INDEX_BLOCK.unpack_from(data, offset)
+    if kind != INDEX or marker != INDEX_MARKER:
+        return None
+    if not HEADER.size <= spanStart <= offset or previous >= spanStart:
+        return None
+    sensors = {}
+    end = offset + INDEX_BLOCK.size
+    for _ in range(numSensors):
+        if end + SENSOR_ENTRY.size > len(data):
+            return None
+        sensorId, length = SENSOR_ENTRY.unpack_from(data, end)
+        end += SENSOR_ENTRY.size
+        if end + length > len(data):
+            return None
+        sensors[sensorId] = bytes(data[end:end + length]).decode('utf-8')
+        end += length
+    return IndexBlock(offset, end, count, first, last, spanStart, previous,
+                      sensors)
+
+
+def _findLastIndex(data):
+    """
+    Searches the archive contents `data` backwards for the last index block.
+    Returns None if there is none.
+    """
+    stop = len(data)
+    while stop > HEADER.size:
+        start = max(HEADER.size, stop - SEARCH_SIZE)
+        window = bytes(data[start:stop + len(INDEX_MARKER)])
+        position = len(window)
+        while True:
+            position = window.rfind(INDEX_MARKER, 0, position)
+            if position < 1:
+                break
+            # Samples may contain the marker by chance, so check the block
+            index = _readIndex(data, start + position - 1)
+            if index is not None:
+                return index
+        stop = start
+    return None
+
+
+def _iterBlocks(data, offset, sensors):
+    """
+    Parses the blocks of the archive contents `data` from `offset` on. The
+    names of sensor blocks are added to `sensors`. A block cut short at the
+    end of `data`, as left behind by a crash, ends the iteration.
+
+    Yields:
+        tuple       block   (offset, end, kind, content) of every block. The
+                            content is a (sensor ID, timestamp, value) tuple
+                            for samples, the sensor ID for sensor blocks and
+                            an `IndexBlock` for index blocks
+    """
+    size = len(data)
+    while offset < size:
+        kind = ord(data[offset:offset + 1])
+        if kind == SAMPLE:
+            end = offset + SAMPLE_BLOCK.size
+            if end > size:
+                return
+            content = SAMPLE_BLOCK.unpack_from(data, offset)[1:]
+        elif kind == SENSOR:
+            end = offset + SENSOR_BLOCK.size
+            if end > size:
+                return
+            _, content, length = SENSOR_BLOCK.unpack_from(data, offset)
+            if end + length > size:
+                return
+            sensors[content] = bytes(data[end:end + length]).decode('utf-8')
+            end += length
+        elif kind == INDEX:
+            content = _readIndex(data, offset)
+            if content is None:
+                return
+            end = content.end
+        else:
+            logging.error('Invalid block kind {} at offset {} of raw beacon '
+                          'archive'.format(kind, offset))
+            return
+        yield offset, end, kind, content
+        offset = end
+
+
+def replay(fileName, start=None):
+    """
+    Replays a raw beacon archive. Consecutive samples with the same
+    timestamp are yielded together, as they were received in one beacon.
+    If `start` is given, the spans that end before it are skipped with the
+    help of the index blocks.
+
+    Receives:
+        string      fileName    Archive to be read
+        float       start       Earliest timestamp (seconds since epoch) of
+                                interest
+    Yields:
+        list        beacon      [sensor, timestamp, raw value] lists with
+                                timestamps in seconds since epoch
+    """
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    header = data[:HEADER.size]
+    if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+        raise ValueError('{} is not a raw beacon archive'.format(fileName))
+
+    offset = HEADER.size
+    sensors = {}
+    if start is not None:
+        # Walk the index blocks back to the first span that is not earlier
+        # than `start`
+        index = _findLastIndex(data)
+        if index is not None:
+            offset = index.end
+            sensors = dict(index.sensors)
+        while index is not None and index.last >= start:
+            offset = index.spanStart
+            index = (_readIndex(data, index.previous)
+                     if index.previous >= 0 else None)
+            sensors = dict(index.sensors) if index is not None else {}
+
+    beacon = []
+    for _, _, kind, content in _iterBlocks(data, offset, sensors):
+        if kind != SAMPLE:
+            continue
+        sensorId, timestamp, value = content
+        if start is not None and timestamp < start:
+            continue
+        if beacon and beacon[-1][1] != timestamp:
+            yield beacon
+            beacon = []
+        beacon.append([sensors[sensorId], timestamp, value])
+    if beacon:
+        yield beacon
+
+
+def readColumns(fileName):
+    """
+    Reads a raw beacon archive into per-sensor columns.
+
+    Receives:
+        string      fileName    Archive to be read
+    Returns:
+        dict        columns     Sensor names as keys and tuples of timestamp
+                                (seconds since epoch) and value arrays as
+                                values, in the order they were received
+    """
+    samples = {}
+    for beacon in replay(fileName):
+        for sensor, timestamp, value in beacon:
+            times, values = samples.setdefault(sensor, ([], []))
+            times.append(timestamp)
+            values.append(value)
+    return dict((sensor, (np.array(times), np.array(values)))
+                for sensor, (times, values) in samples.items())
+
+
+class RawArchive(object):
+    """
+    Append-only binary archive of the raw beacon data received in live
+    mode. Every sample is stored as a fixed-width block of sensor ID,
+    timestamp and raw value, so the data written per beacon does not depend
+    on how long the monitor has been running. Sensor names are written once,
+    when a sensor is first seen. Every `indexInterval` samples an index
+    block is written (see `IndexBlock`), which lets `replay` skip to a point
+    in time. The file is only opened on the first write. An existing archive
+    is continued, after cutting off a block left incomplete by a crash.
+    """
+    def __init__(self, fileName, indexInterval=INDEX_INTERVAL):
+        self.fileName = fileName
+        self.indexInterval = indexInterval
+        # Sensor names as keys and sensor IDs as values
+        self.sensors = {}
+        self._file = None
+        self._lastIndex = -1
+        self._spanStart = None
+        self._spanCount = 0
+        self._spanFirst = np.inf
+        self._spanLast = -np.inf
+
+
+    def _open(self):
+        if not os.path.isfile(self.fileName) or \
+                os.path.getsize(self.fileName) < HEADER.size:
+            self._file = open(self.fileName, 'wb')
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+            self._spanStart = HEADER.size
+            return
+
+        # Only the blocks after the last index block are parsed, so the
+        # archive is mapped rather than read, and only its tail is paged in
+        with open(self.fileName, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if HEADER.unpack(data[:HEADER.size])[0] != MAGIC:
+                raise ValueError('{} is not a raw beacon archive'
+                                 .format(self.fileName))
+            index = _findLastIndex(data)
+            sensors = {}
+            end = HEADER.size
+            if index is not None:
+                sensors = dict(index.sensors)
+                end = index.end
+                self._lastIndex = index.offset
+            self._spanStart = end
+            for offset, end, kind, content in _iterBlocks(data, end,
+                                                          sensors):
+                if kind == SAMPLE:
+                    self._addToSpan(content[1])
+                elif kind == INDEX:
+                    # The last index block was not found by searching for it
+                    self._lastIndex = offset
+                    self._spanStart = end
+                    self._spanCount = 0
+                    self._spanFirst = np.inf
+                    self._spanLast = -np.inf
+            size = len(data)
+        finally:
+            data.close()
+        self.sensors = dict((name, sensorId)
+                            for sensorId, name in sensors.items())
+        self._file = open(self.fileName, 'r+b')
+        if end < size:
+            logging.warning('Dropping {} bytes of incomplete data at the end '
+                            'of {}'.format(size - end, self.fileName))
+            self._file.truncate(end)
+        self._file.seek(end)
+
+
+    def _addToSpan(self, timestamp):
+        self._spanCount += 1
+        self._spanFirst = min(self._spanFirst, timestamp)
+        self._spanLast = max(self._spanLast, timestamp)
+
+
+    def addColumns(self, sensors, ids, timestamps, values):
+        """
+        Appends samples given as columns, e.g. those of a
+        `hkbeacon.BeaconBatch`, and flushes them to disk. The sample blocks
+        are packed all at once as a structured array.
+
+        Receives:
+            list        sensors     Sensor names, indexed by `ids`
+            numpy array ids         Sensor of every sample
+            numpy array timestamps  Timestamps (seconds since epoch)
+            numpy array values      Raw values
+        """
+        if self._file is None:
+            self._open()
+        if not len(ids):
+            return
+        blocks = []
+        archiveIds = np.zeros(len(sensors), dtype=np.uint16)
+        for sensorId in np.unique(ids).tolist():
+            archiveIds[sensorId] = self._sensorId(sensors[sensorId], blocks)
+        records = np.empty(len(ids), dtype=SAMPLE_DTYPE)
+        records['kind'] = SAMPLE
+        records['sensor'] = archiveIds[ids]
+        records['timestamp'] = timestamps
+        records['value'] = values
+
+        # Split the samples where index blocks are due
+        done = 0
+        while done < records.size:
+            count = min(records.size - done,
+                        self.indexInterval - self._spanCount)
+            span = records[done:done + count]
+            blocks.append(span.tobytes())
+            self._spanCount += count
+            self._spanFirst = min(self._spanFirst,
+                                  float(span['timestamp'].min()))
+            self._spanLast = max(self._spanLast,
+                                 float(span['timestamp'].max()))
+            done += count
+            if self._spanCount >= self.indexInterval:
+                blocks.append(self._indexBlock(sum(len(block)
+                                                   for block in blocks)))
+        self._file.write(b''.join(blocks))
+        self._file.flush()
+
+
+    def _sensorId(self, sensor, blocks):
+        """
+        Returns the ID of `sensor`. A new sensor gets the next ID, and its
+        sensor block is appended to `blocks`.
+        """
+        if sensor not in self.sensors:
+            sensorId = len(self.sensors)
+            self.sensors[sensor] = sensorId
+            name = _encode(sensor)
+            blocks.append(SENSOR_BLOCK.pack(SENSOR, sensorId, len(name)))
+            blocks.append(name)
+        return self.sensors[sensor]
+
+
+    def _indexBlock(self, pending):
+        """
+        Packs the index block of the current span and starts a new one.
+        `pending` is the number of bytes to be written before the block.
+        """
+        offset = self._file.tell() + pending
+        entries = []
+        for name, sensorId in sorted(self.sensors.items(),
+                                     key=lambda item: item[1]):
+            name = _encode(name)
+            entries.append(SENSOR_ENTRY.pack(sensorId, len(name)))
+            entries.append(name)
+        block = INDEX_BLOCK.pack(INDEX, INDEX_MARKER, self._spanCount,
+                                 self._spanFirst, self._spanLast,
+                                 self._spanStart, self._lastIndex,
+                                 len(self.sensors))
+        block += b''.join(entries)
+        self._lastIndex = offset
+        self._spanStart = offset + len(block)
+        self._spanCount = 0
+        self._spanFirst = np.inf
+        self._spanLast = -np.inf
+        return block
+
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,315 @@
+import ast
+import calendar
+import datetime
+import json
+import logging
+import re
+import time
+
+import numpy as np
+
+import hkdata
+import hksteady
+
+try:
+    import msgpack
+    msgpackImported = True
+except ImportError:
+    msgpackImported = False
+
+# Fields of a beacon that are not sensor values
+HEADER_FIELDS = ('Beacon Timestamp', 'Beacon Version', 'Source', 'Source ID')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Types of valid sensor values. Booleans are not valid even though they are
+# integers
+try:
+    NUMBER_TYPES = (int, long, float)
+except NameError:
+    NUMBER_TYPES = (int, float)
+
+# Start of the body of a legacy beacon, the repr of a dict, whose keys are
+# quoted with ' where JSON quotes them with "
+LITERAL_START = re.compile(r"\s*\{\s*'")
+
+# Content types of msgpack encoded messages
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Routing keys of the beacons the monitor uses: CDH beacons carry the beacon
+# time, THM beacons the sensor values
+CDH = 'CDH'
+THM = 'THM'
+
+
+class BeaconSchema(object):
+    """
+    The sensors that may appear in THM beacons, each with a numeric ID.
+    Sensors of `sensorInfo` (default `hkdata.thm_bytes`) keep their
+    SENSOR_ID. The sensors of `sensorMapping` (e.g. `mapping.mapping`) and
+    the system state sensors that have no SENSOR_ID are numbered after the
+    largest one in alphabetical order, so the IDs never depend on dict order.
+    """
+    def __init__(self, sensorInfo=None, sensorMapping=None):
+        if sensorInfo is None:
+            sensorInfo = hkdata.thm_bytes
+        self.ids = dict((str(info[0]), info[3]) for info in sensorInfo
+                        if info[3] is not None)
+        nextId = max(self.ids.values()) + 1 if self.ids else 0
+        others = set(str(name) for name in sensorMapping or ())
+        others.update(hksteady.STATE_SENSORS)
+        for name in sorted(others - set(self.ids)):
+            self.ids[name] = nextId
+            nextId += 1
+        # Sensor names by ID, None for unused IDs
+        self.names = [None] * nextId
+        for name, sensorId in self.ids.items():
+            self.names[sensorId] = name
+
+
+class Beacon(object):
+    """
+    A parsed beacon. `timestamp` is the beacon time of CDH beacons (None
+    for others), `ids` and `values` are the IDs (see `BeaconSchema`) and
+    values of the sensors of THM beacons.
+    """
+    def __init__(self, routingKey, timestamp=None, ids=None, values=None):
+        self.routingKey = routingKey
+        self.timestamp = timestamp
+        self.ids = np.empty(0, dtype=np.int32) if ids is None else ids
+        self.values = np.empty(0) if values is None else values
+
+
+class BeaconParser(object):
+    """
+    Parses the messages received from RabbitMQ into `Beacon`s. Messages are
+    JSON encoded, or msgpack encoded if their content type says so and
+    msgpack is installed. Messages that are neither are parsed as Python
+    literals with `ast.literal_eval`, which is safe but slow, and counted in
+    `legacyMessages`.
+
+    The payload must be an object; CDH beacons must hold a valid 'Beacon
+    Timestamp'. Other messages are counted in `messagesMalformed` and
+    dropped. Fields of THM beacons that are neither header fields nor
+    sensors of the schema are dropped and counted in `unknownFields`,
+    non-numeric sensor values in `invalidValues`. Parsing never raises.
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self.messagesParsed = 0
+        self.messagesMalformed = 0
+        self.messagesIgnored = 0
+        self.legacyMessages = 0
+        self.unknownFields = 0
+        self.invalidValues = 0
+        # Unknown fields already logged
+        self.unknownNames = set()
+
+
+    def decode(self, body, contentType=None):
+        """
+        Decodes a message body into a dict. Raises ValueError if that fails.
+        Legacy beacons are told from JSON by their first key, so that either
+        is parsed once.
+        """
+        if contentType in MSGPACK_TYPES:
+            if not msgpackImported:
+                raise ValueError('msgpack is not installed')
+            try:
+                payload = msgpack.unpackb(body, raw=False)
+            except Exception as e:
+                raise ValueError(e)
+        else:
+            if isinstance(body, bytes):
+                body = body.decode('utf-8')
+            if LITERAL_START.match(body):
+                payload = self.decodeLiteral(body)
+            else:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = self.decodeLiteral(body)
+        if not isinstance(payload, dict):
+            raise ValueError('payload is a {}, not an object'
+                             .format(type(payload).__name__))
+        return payload
+
+
+    def decodeLiteral(self, body):
+        """
+        Decodes the body of a legacy beacon. Raises ValueError if that fails.
+        """
+        try:
+            payload = ast.literal_eval(body.strip())
+        except (SyntaxError, TypeError, ValueError):
+            raise ValueError('neither JSON nor a Python literal')
+        self.legacyMessages += 1
+        return payload
+
+
+    def parse(self, body, routingKey, contentType=None):
+        """
+        Parses a message.
+
+        Receives:
+            string      body        Message body
+            string      routingKey  Routing key of the message
+            string      contentType Content type of the message, if any
+        Returns:
+            Beacon      beacon      The parsed beacon, or None if the message
+                                    is malformed or neither a CDH nor a THM
+                                    beacon
+        """
+        if routingKey not in (CDH, THM):
+            self.messagesIgnored += 1
+            return None
+        try:
+            payload = self.decode(body, contentType)
+            if routingKey == CDH:
+                beacon = Beacon(routingKey, self.timestamp(payload))
+            else:
+                beacon = self.sensorValues(payload)
+        except ValueError as e:
+            self.messagesMalformed += 1
+            logging.error('Dropped malformed {} beacon: {}'
+                          .format(routingKey, e))
+            return None
+        self.messagesParsed += 1
+        return beacon
+
+
+    @staticmethod
+    def timestamp(payload):
+        try:
+            return datetime.datetime.strptime(payload['Beacon Timestamp'],
+                                              TIMESTAMP_FORMAT)
+        except KeyError:
+            raise ValueError('no Beacon Timestamp')
+        except TypeError:
+            raise ValueError('Beacon Timestamp is not a string')
+
+
+    def sensorValues(self, payload):
+        """
+        Collects the sensor values of a THM beacon into arrays.
+        """
+        ids = []
+        values = []
+        for name, value in payload.items():
+            sensorId = self.schema.ids.get(name)
+            if sensorId is None:
+                if name not in HEADER_FIELDS:
+                    self.unknownFields += 1
+                    if name not in self.unknownNames:
+                        self.unknownNames.add(name)
+                        logging.warning('Dropping unknown field {!r} of THM '
+                                        'beacons'.format(name))
+                continue
+            if type(value) not in NUMBER_TYPES:
+                self.invalidValues += 1
+                logging.warning('Dropped invalid value {!r} of {}'
+                                .format(value, name))
+                continue
+            ids.append(sensorId)
+            values.append(value)
+        return Beacon(THM, ids=np.array(ids, dtype=np.int32),
+                      values=np.array(values, dtype=np.float64))
+
+
+    def summary(self):
+        return ('{} beacons parsed, {} malformed, {} ignored, {} in legacy '
+                'format; {} unknown fields and {} invalid values dropped'
+                .format(self.messagesParsed, self.messagesMalformed,
+                        self.messagesIgnored, self.legacyMessages,
+                        self.unknownFields, self.invalidValues))
+
+
+class BeaconBatch(object):
+    """
+    The samples of several THM beacons in columns: sample i is the value
+    `values[i]` of the sensor `sensors[ids[i]]` at `timestamps[i]` (beacon
+    time in seconds since epoch, without time zone conversion).
+    """
+    def __init__(self, sensors, ids, timestamps, values, beacons):
+        self.sensors = sensors
+        self.ids = ids
+        self.timestamps = timestamps
+        self.values = values
+        # Number of beacons in the batch
+        self.beacons = beacons
+
+
+    def __len__(self):
+        return self.ids.size
+
+
+    def feed(self):
+        """
+        Returns the samples in the [sensor, beacon time, value] list format
+        of single beacons.
+        """
+        times = [datetime.datetime.utcfromtimestamp(t)
+                 for t in self.timestamps.tolist()]
+        return [[self.sensors[sensorId], t, value] for sensorId, t, value
+                in zip(self.ids.tolist(), times, self.values.tolist())]
+
+
+class BeaconBatcher(object):
+    """
+    Collects THM beacons into `BeaconBatch`es. A batch is due once it holds
+    `maxBeacons` beacons or its first beacon is `maxAge` seconds old, so
+    bursts of beacons cost one batch instead of one hand-over per beacon,
+    while a single beacon is delayed by at most `maxAge`.
+    """
+    def __init__(self, schema, maxBeacons=50, maxAge=0.1):
+        self.schema = schema
+        self.maxBeacons = maxBeacons
+        self.maxAge = maxAge
+        self.ids = []
+        self.timestamps = []
+        self.values = []
+        # Time the first beacon of the batch was added
+        self.started = None
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def add(self, beacon, beaconTime):
+        """
+        Adds a THM beacon received at `beaconTime` (datetime).
+
+        Returns:
+            boolean     due     Whether the batch should be taken now
+        """
+        if self.started is None:
+            self.started = time.time()
+        timestamp = calendar.timegm(beaconTime.timetuple()) + \
+            beaconTime.microsecond / 1e6
+        self.ids.append(beacon.ids)
+        self.timestamps.append(np.full(beacon.ids.size, timestamp))
+        self.values.append(beacon.values)
+        return self.due()
+
+
+    def due(self):
+        return self.started is not None and (
+            len(self.ids) >= self.maxBeacons or
+            time.time() - self.started >= self.maxAge)
+
+
+    def take(self):
+        """
+        Returns the collected beacons as a `BeaconBatch` and starts a new
+        batch, or returns None if there are none.
+        """
+        if not self.ids:
+            return None
+        batch = BeaconBatch(self.schema.names, np.concatenate(self.ids),
+                            np.concatenate(self.timestamps),
+                            np.concatenate(self.values), len(self.ids))
+        self.ids = []
+        self.timestamps = []
+        self.values = []
+        self.started = None
+        return batch
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+
+# Default location and size limit of the decoded file cache
+CACHE_DIR = 'cache'
+MAX_SIZE = 2 * 1024 ** 3
+
+# Bytes hashed at the beginning and at the end of a file to fingerprint it
+FINGERPRINT_SIZE = 64 * 1024
+
+TIMES = 'Timestamp'
+
+
+def entryArrays(columns):
+    """
+    Returns the arrays of the cache entry of decoded `columns`: the shared
+    timestamp column and one value column per sensor.
+    """
+    arrays = dict((str(name), values)
+                  for name, (times, values) in columns.items())
+    arrays[TIMES] = next(iter(columns.values()))[0]
+    return arrays
+
+
+class DecodedFileCache(object):
+    """
+    On-disk cache of decoded journald files. Every file is stored as an
+    uncompressed `.npz` sidecar holding the shared timestamp column and one
+    value column per sensor, as returned by `hkdecoder.decode`.
+
+    Entries are keyed by the file's absolute path, size, modification time
+    and a hash of its first and last `FINGERPRINT_SIZE` bytes. The
+    least recently used entries are evicted once the cache grows beyond
+    `maxSize` bytes.
+    """
+    def __init__(self, directory=CACHE_DIR, maxSize=MAX_SIZE):
+        self.directory = directory
+        self.maxSize = maxSize
+
+
+    def key(self, fileName):
+        """
+        Computes the cache key of `fileName`.
+        """
+        stat = os.stat(fileName)
+        digest = hashlib.sha1()
+        digest.update('{}\n{}\n{!r}\n'.format(os.path.abspath(fileName),
+                                              stat.st_size, stat.st_mtime)
+                      .encode('utf-8'))
+        with open(fileName, 'rb') as f:
+            digest.update(f.read(FINGERPRINT_SIZE))
+            if stat.st_size > 2 * FINGERPRINT_SIZE:
+                f.seek(-FINGERPRINT_SIZE, os.SEEK_END)
+                digest.update(f.read(FINGERPRINT_SIZE))
+        return digest.hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+
+    def load(self, fileName):
+        """
+        Returns the cached columns of `fileName` or None if there are none.
+        """
+        path = self.path(self.key(fileName))
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as entry:
+                times = entry[TIMES]
+                columns = dict((name, (times, entry[name]))
+                               for name in entry.files if name != TIMES)
+        except (IOError, ValueError, KeyError) as e:
+            logging.error('Could not read cache entry {}: {}'
+                          .format(path, e))
+            return None
+        # Mark as recently used
+        os.utime(path, None)
+        logging.info('Loaded {} from cache entry {}'.format(fileName, path))
+        return columns
+
+
+    def store(self, fileName, columns):
+        """
+        Stores the decoded `columns` of `fileName` and evicts old entries if
+        necessary. All columns must share the same timestamp array.
+        """
+        if not columns:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        arrays = entryArrays(columns)
+
+        # Write to a temporary file first so that no reader ever sees a
+        # partially written entry
+        path = self.path(self.key(fileName))
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmpPath, path)
+        self.evict()
+
+
+    def writer(self, fileName):
+        """
+        Returns an `EntryWriter` that stores the columns of `fileName` as they
+        are decoded block by block.
+        """
+        return EntryWriter(self, fileName)
+
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size of the
+        cache is at most `maxSize` bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxSize:
+                break
+            logging.info('Evicting cache entry {}'.format(path))
+            os.remove(path)
+            total -= size
+
+
+class EntryWriter(object):
+    """
+    Stores the cache entry of a file that is decoded block by block. Every
+    column is appended to a temporary file as blocks are added, so that no
+    block has to be kept in memory. `close` then copies the columns into the
+    `.npz` entry one at a time. The temporary files are removed by `close`
+    and `discard`.
+    """
+    def __init__(self, cache, fileName):
+        self.cache = cache
+        self.fileName = fileName
+        if not os.path.isdir(cache.directory):
+            os.makedirs(cache.directory)
+        self.tmpDirectory = tempfile.mkdtemp(suffix='.tmp',
+                                             dir=cache.directory)
+        # Temporary file and dtype of every column
+        self.columns = {}
+        self.rows = 0
+
+
+    def add(self, columns):
+        """
+        Appends the decoded `columns` of one block. All of them must share
+        the same timestamp array.
+        """
+        if not columns:
+            return
+        arrays = entryArrays(columns)
+        for name, array in arrays.items():
+            if name not in self.columns:
+                path = os.path.join(self.tmpDirectory,
+                                    str(len(self.columns)))
+                self.columns[name] = (path, array.dtype)
+            with open(self.columns[name][0], 'ab') as f:
+                np.ascontiguousarray(array).tofile(f)
+        self.rows += arrays[TIMES].size
+
+
+    def close(self):
+        """
+        Writes the entry and evicts old entries if necessary.
+        """
+        try:
+            if self.columns:
+                self._write()
+                self.cache.evict()
+        finally:
+            self.discard()
+
+
+    def _write(self):
+        # Write to a temporary file first so that no reader ever sees a
+        # partially written entry
+        path = self.cache.path(self.cache.key(self.fileName))
+        tmpPath = path + '.tmp'
+        with zipfile.ZipFile(tmpPath, 'w', zipfile.ZIP_STORED,
+                             allowZip64=True) as entry:
+            for name, (columnPath, dtype) in self.columns.items():
+                arrayPath = columnPath + '.npy'
+                with open(arrayPath, 'wb') as f:
+                    header = {'descr': np.lib.format.dtype_to_descr(dtype),
+                              'fortran_order': False,
+                              'shape': (self.rows,)}
+                    np.lib.format.write_array_header_1_0(f, header)
+                    with open(columnPath, 'rb') as column:
+                        shutil.copyfileobj(column, f)
+                os.remove(columnPath)
+                entry.write(arrayPath, name + '.npy')
+                os.remove(arrayPath)
+        os.rename(tmpPath, path)
+
+
+    def discard(self):
+        """
+        Removes the temporary files without storing the entry.
+        """
+        shutil.rmtree(self.tmpDirectory, ignore_errors=True)
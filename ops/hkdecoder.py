@@ -0,0 +1,731 @@
+import contextlib
+import logging
+import mmap
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import beaconconvert
+import hkdata
+
+NEWLINE = 10
+
+# Earliest plausible record timestamp (2000-01-01)
+MIN_TIMESTAMP = 946684800
+
+# Largest plausible step in seconds between the timestamps of consecutive
+# records. Records that step further ahead, or back in time, break the
+# continuity of the records before them.
+MAX_TIME_STEP = 24 * 3600
+
+# Number of consecutive valid records required where decoding resumes after
+# damaged data
+CONFIRM_RECORDS = 4
+
+# Number of records checked at a time, both for runs of intact records and
+# for resynchronization points after damaged data
+PROBE_RECORDS = 64
+
+# Number of records decoded at a time by `iterBlocks`
+BLOCK_SIZE = 100000
+
+_dtypes = {}
+
+
+def recordDtype(sensorInfo=None):
+    """
+    Compiles a housekeeping record description such as `hkdata.thm_bytes`
+    into a packed NumPy structured dtype with one field per entry.
+
+    Receives:
+        list        sensorInfo  Record description. Default: hkdata.thm_bytes
+    Returns:
+        numpy dtype             Structured dtype of one record
+    """
+    if sensorInfo is None:
+        sensorInfo = hkdata.thm_bytes
+    key = id(sensorInfo)
+    if key not in _dtypes:
+        fields = [(str(info[0]), np.dtype(str(info[1])))
+                  for info in sensorInfo]
+        _dtypes[key] = np.dtype(fields)
+    return _dtypes[key]
+
+
+def _timestamps(raw, starts, dtype):
+    """
+    Reads the `Timestamp` field of the records starting at `starts`.
+    """
+    fieldDtype, fieldOffset = dtype.fields['Timestamp'][:2]
+    columns = np.arange(fieldOffset, fieldOffset + fieldDtype.itemsize)
+    rows = raw[starts[:, np.newaxis] + columns]
+    return rows.view(fieldDtype).reshape(starts.size).astype(np.int64)
+
+
+def _isValid(raw, starts, dtype, minTimestamp, maxTimestamp):
+    """
+    Checks whether the records starting at `starts` end in a line terminator
+    and carry a plausible timestamp.
+
+    Returns:
+        numpy array valid       Whether each record is valid
+        numpy array times       Timestamp of each record
+    """
+    terminated = raw[starts + dtype.itemsize - 1] == NEWLINE
+    times = _timestamps(raw, starts, dtype)
+    plausible = (minTimestamp <= times) & (times <= maxTimestamp)
+    return terminated & plausible, times
+
+
+def _continues(times, lastTime):
+    """
+    Checks whether each of `times` continues the timestamp before it, the
+    first one continuing `lastTime` (always true if that is None).
+    """
+    first = times[0] if lastTime is None else lastTime
+    steps = times - np.concatenate(([first], times[:-1]))
+    return (steps >= 0) & (steps <= MAX_TIME_STEP)
+
+
+def _validRun(raw, start, count, dtype, minTimestamp, maxTimestamp,
+              lastTime):
+    """
+    Counts the consecutive valid records at `start`, `start + recordSize`,
+    ..., up to `count` of them, whose timestamps continue `lastTime` and one
+    another. Records are checked in growing batches, so the cost is
+    proportional to the length of the run rather than to `count`.
+
+    Returns:
+        integer     run         Number of records in the run
+        integer     lastTime    Timestamp of the last record of the run, or
+                                `lastTime` if the run is empty
+    """
+    recordSize = dtype.itemsize
+    run = 0
+    probe = PROBE_RECORDS
+    while run < count:
+        batch = np.arange(run, min(run + probe, count))
+        starts = start + batch * recordSize
+        valid, times = _isValid(raw, starts, dtype, minTimestamp,
+                                maxTimestamp)
+        valid &= _continues(times, lastTime)
+        invalid = np.flatnonzero(~valid)
+        if invalid.size:
+            if invalid[0]:
+                lastTime = int(times[invalid[0] - 1])
+            return run + int(invalid[0]), lastTime
+        run += starts.size
+        lastTime = int(times[-1])
+        probe *= 2
+    return run, lastTime
+
+
+def _chainLengths(raw, starts, dtype, minTimestamp, maxTimestamp):
+    """
+    Counts the consecutive valid records with continuous timestamps at each
+    of `starts`, up to `CONFIRM_RECORDS`. Records that would extend past the
+    end of `raw` count as valid.
+
+    Returns:
+        numpy array lengths     Number of records in each chain
+        numpy array times       Timestamp of the record at each start
+    """
+    recordSize = dtype.itemsize
+    chains = starts[:, np.newaxis] + np.arange(CONFIRM_RECORDS) * recordSize
+    inside = chains + recordSize <= raw.size
+    # Records outside are checked at offset 0 and then ignored
+    chains = np.where(inside, chains, 0).ravel()
+    valid, times = _isValid(raw, chains, dtype, minTimestamp, maxTimestamp)
+    valid = valid.reshape(inside.shape)
+    times = times.reshape(inside.shape)
+    steps = np.diff(times, axis=1)
+    valid[:, 1:] &= (steps >= 0) & (steps <= MAX_TIME_STEP)
+    valid |= ~inside
+    return valid.cumprod(axis=1).sum(axis=1), times[:, 0]
+
+
+def _resync(raw, damaged, dtype, minTimestamp, maxTimestamp, lastTime):
+    """
+    Finds where decoding resumes after the record expected at `damaged`
+    turned out to be invalid. Candidates are the offsets of all records that
+    end in a newline. A candidate whose timestamp continues `lastTime` only
+    needs to be valid itself, any other one must start a chain of
+    `CONFIRM_RECORDS` valid records. The search proceeds in growing windows,
+    so only the damaged region is scanned. Within the first window that
+    holds any, the earliest candidate whose timestamp continues `lastTime`
+    is taken, or if there is none, the earliest candidate at all. Where it
+    overlaps a candidate that continues the record step from `damaged`, the
+    latter is taken instead.
+
+    Returns:
+        integer     offset      Offset at which decoding resumes, or None if
+                                there is no valid record after `damaged`
+    """
+    recordSize = dtype.itemsize
+    last = raw.size - recordSize
+    begin = damaged
+    probe = PROBE_RECORDS
+    while begin <= last:
+        end = min(last + 1, begin + probe * recordSize)
+        # Every record that ends in a newline
+        terminators = raw[begin + recordSize - 1:end + recordSize - 1]
+        candidates = np.flatnonzero(terminators == NEWLINE) + begin
+        lengths, times = _chainLengths(raw, candidates, dtype, minTimestamp,
+                                       maxTimestamp)
+        if lastTime is None:
+            steady = np.zeros(candidates.size, dtype=bool)
+        else:
+            steady = (lengths > 0) & (times >= lastTime) & \
+                (times - lastTime <= MAX_TIME_STEP)
+        usable = steady | (lengths == CONFIRM_RECORDS)
+        aligned = (candidates - damaged) % recordSize == 0
+        for preferred in (steady, usable):
+            if preferred.any():
+                first = candidates[preferred][0]
+                rivals = preferred & aligned & \
+                    (candidates < first + recordSize)
+                return int(candidates[rivals][0] if rivals.any() else first)
+        begin = end
+        probe *= 2
+    return None
+
+
+def iterRecordOffsets(buf, blockSize=BLOCK_SIZE, sensorInfo=None,
+                      minTimestamp=MIN_TIMESTAMP, maxTimestamp=None, start=0,
+                      growing=False, stop=None):
+    """
+    Finds the start offsets of all valid records in `buf` in linear time,
+    yielding windows of at most `blockSize` records so that memory use does
+    not depend on the size of `buf`.
+    A record is valid if its last byte is the line terminator and its
+    timestamp lies between `minTimestamp` and `maxTimestamp`. Records are
+    expected back to back from `start` on. Where a record is invalid, or its
+    timestamp steps back in time or more than `MAX_TIME_STEP` ahead, the
+    scan resynchronizes (see `_resync`). Everything in between valid records
+    is reported as skipped.
+
+    Receives:
+        buffer      buf             Raw journald file contents
+        integer     blockSize       Number of records per window
+        list        sensorInfo      Record description.
+                                    Default: hkdata.thm_bytes
+        integer     minTimestamp    Earliest plausible timestamp (seconds
+                                    since epoch). Default: 2000-01-01
+        integer     maxTimestamp    Latest plausible timestamp. Default: one
+                                    day from now
+        integer     start           Offset at which a record is known to
+                                    start. Everything before is ignored.
+        boolean     growing         Whether `buf` is still being written to.
+                                    If so, bytes after the last valid record
+                                    are not reported as skipped since they
+                                    may be a record that is not complete yet
+        integer     stop            Offset before which the last record
+                                    starts. Default: end of `buf`
+    Yields:
+        numpy array offsets         Start offsets of the valid records found
+                                    in the window
+        list        skipped         (start, end) byte ranges in front of
+                                    these records that were not part of any
+                                    valid record
+    """
+    dtype = recordDtype(sensorInfo)
+    recordSize = dtype.itemsize
+    if maxTimestamp is None:
+        maxTimestamp = time.time() + 24 * 3600
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    size = raw.size
+    if stop is None:
+        stop = size
+    # Offset of the next record and timestamp of the record before it
+    pos = start
+    lastTime = None
+    lastEnd = start
+    runs = []
+    skipped = []
+    count = 0
+    while pos < stop and pos + recordSize <= size:
+        limit = min(blockSize - count, (size - pos) // recordSize,
+                    -(-(stop - pos) // recordSize))
+        run, lastTime = _validRun(raw, pos, limit, dtype, minTimestamp,
+                                  maxTimestamp, lastTime)
+        if run:
+            runs.append(pos + np.arange(run, dtype=np.int64) * recordSize)
+            count += run
+            pos = lastEnd = pos + run * recordSize
+            if count == blockSize:
+                yield np.concatenate(runs), skipped
+                runs = []
+                skipped = []
+                count = 0
+            continue
+
+        resumed = _resync(raw, pos, dtype, minTimestamp, maxTimestamp,
+                          lastTime)
+        if resumed is None or resumed >= stop:
+            break
+        if resumed > lastEnd:
+            skipped.append((lastEnd, resumed))
+        # The records at `resumed` are confirmed on their own
+        pos = resumed
+        lastTime = None
+
+    if lastEnd < stop and not growing:
+        skipped.append((lastEnd, stop))
+    if runs or skipped:
+        offsets = np.concatenate(runs) if runs else np.zeros(0, dtype=np.int64)
+        yield offsets, skipped
+
+
+def scanRecords(buf, sensorInfo=None, minTimestamp=MIN_TIMESTAMP,
+                maxTimestamp=None):
+    """
+    Finds the start offsets of all valid records in `buf`. See
+    `iterRecordOffsets`.
+
+    Returns:
+        numpy array offsets         Start offsets of all valid records
+        list        skipped         (start, end) byte ranges that were not
+                                    part of any valid record
+    """
+    allOffsets = [np.zeros(0, dtype=np.int64)]
+    allSkipped = []
+    for offsets, skipped in iterRecordOffsets(buf, BLOCK_SIZE, sensorInfo,
+                                              minTimestamp, maxTimestamp):
+        allOffsets.append(offsets)
+        allSkipped.extend(skipped)
+    return np.concatenate(allOffsets), allSkipped
+
+
+class DecodeReport(object):
+    """
+    Statistics collected while decoding journald files: number of records
+    decoded and skipped, resynchronization events and the range of raw
+    values seen per sensor.
+
+    If `traceEvery` is set, every `traceEvery`-th decoded record is logged
+    field by field at debug level. This replaces the unconditional per-field
+    logging of the original thm_processor, which dominated load times.
+    """
+    def __init__(self, sensorInfo=None, traceEvery=0):
+        self.sensorInfo = sensorInfo
+        self.traceEvery = traceEvery
+        self.recordsDecoded = 0
+        # Offset right after the last decoded record
+        self.end = 0
+        self.recordsSkipped = 0
+        self.bytesSkipped = 0
+        self.resyncs = 0
+        self.rawMin = {}
+        self.rawMax = {}
+
+
+    def addSkipped(self, skipped, offset=0):
+        """
+        Accounts for the (start, end) byte ranges in `skipped`, which are
+        relative to `offset`.
+        """
+        recordSize = recordDtype(self.sensorInfo).itemsize
+        for start, end in skipped:
+            logging.error('Discarded bytes {} to {} since they did not form '
+                          .format(start + offset, end + offset - 1) +
+                          'a valid record')
+            self.resyncs += 1
+            self.bytesSkipped += end - start
+            self.recordsSkipped += -(-(end - start) // recordSize)
+
+
+    def addRecords(self, records, offsets, offset=0):
+        """
+        Accounts for decoded `records` found at byte `offsets` (relative to
+        `offset`).
+        """
+        if records.size == 0:
+            return
+        for name in columnNames(self.sensorInfo):
+            column = records[str(name)]
+            low = column.min().item()
+            high = column.max().item()
+            self.rawMin[name] = min(low, self.rawMin.get(name, low))
+            self.rawMax[name] = max(high, self.rawMax.get(name, high))
+
+        if self.traceEvery:
+            first = -self.recordsDecoded % self.traceEvery
+            for i in range(first, records.size, self.traceEvery):
+                self._trace(records[i], offsets[i] + offset)
+        self.recordsDecoded += records.size
+        self.end = int(offsets[-1]) + offset + records.dtype.itemsize
+
+
+    def _trace(self, record, start):
+        dtype = record.dtype
+        for name in dtype.names:
+            fieldDtype, fieldOffset = dtype.fields[name][:2]
+            begin = start + fieldOffset
+            logging.debug('{:40s}: {}-{} {:10}'
+                          .format(name, begin, begin + fieldDtype.itemsize - 1,
+                                  record[name]))
+
+
+    def merge(self, other):
+        """
+        Adds the statistics of the report `other` to this one.
+        """
+        self.recordsDecoded += other.recordsDecoded
+        self.recordsSkipped += other.recordsSkipped
+        self.bytesSkipped += other.bytesSkipped
+        self.resyncs += other.resyncs
+        for name, low in other.rawMin.items():
+            self.rawMin[name] = min(low, self.rawMin.get(name, low))
+        for name, high in other.rawMax.items():
+            self.rawMax[name] = max(high, self.rawMax.get(name, high))
+
+
+    def summary(self):
+        return ('Decoded {} records, skipped about {} records ({} bytes) in '
+                .format(self.recordsDecoded, self.recordsSkipped,
+                        self.bytesSkipped) +
+                '{} resynchronizations'.format(self.resyncs))
+
+
+def _gather(raw, offsets, dtype):
+    """
+    Collects the records starting at `offsets` into a structured array. If
+    they are contiguous, this is a view on `raw`.
+    """
+    count = offsets.size
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    first = offsets[0]
+    last = offsets[-1]
+    # Offsets are strictly increasing, so this means there are no gaps
+    if last - first == (count - 1) * dtype.itemsize:
+        return raw[first:last + dtype.itemsize].view(dtype)
+    rows = raw[offsets[:, np.newaxis] + np.arange(dtype.itemsize)]
+    return rows.view(dtype).reshape(count)
+
+
+def decodeRecords(buf, sensorInfo=None, report=None):
+    """
+    Decodes all well-formed records in `buf` into a structured array. If the
+    file is intact this is a single zero-copy `np.frombuffer` view.
+
+    Receives:
+        buffer          buf         Raw journald file contents
+        list            sensorInfo  Record description.
+                                    Default: hkdata.thm_bytes
+        DecodeReport    report      Collects decoding statistics, if given
+    Returns:
+        numpy array     records     Structured array of dtype `recordDtype()`
+    """
+    if report is None:
+        report = DecodeReport(sensorInfo)
+    offsets, skipped = scanRecords(buf, sensorInfo)
+    report.addSkipped(skipped)
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    records = _gather(raw, offsets, recordDtype(sensorInfo))
+    report.addRecords(records, offsets)
+    return records
+
+
+def splitColumns(records, sensorInfo=None):
+    """
+    Splits decoded records into per-sensor columns and applies each sensor's
+    interpret function, through its lookup table for 16-bit values.
+
+    Receives:
+        numpy array records     Structured array as returned by
+                                `decodeRecords`
+        list        sensorInfo  Record description. Default: hkdata.thm_bytes
+    Returns:
+        dict        columns     Sensor names as keys and tuples of timestamp
+                                (seconds since epoch) and value arrays as
+                                values
+    """
+    if sensorInfo is None:
+        sensorInfo = hkdata.thm_bytes
+    times = records['Timestamp'].astype(np.float64)
+    columns = {}
+    for name, fmt, interpFunc, sensorId in sensorInfo:
+        if sensorId is None:
+            continue
+        raw = records[str(name)]
+        if interpFunc is None:
+            values = raw.astype(np.float64)
+        elif raw.dtype.itemsize == 2:
+            values = beaconconvert.interpretColumn(interpFunc, raw)
+        else:
+            values = np.fromiter((interpFunc(value) for value in raw.tolist()),
+                                 dtype=np.float64, count=raw.size)
+        columns[name] = (times, values)
+    return columns
+
+
+def decode(buf, sensorInfo=None, report=None):
+    """
+    Decodes the contents of a journald THM file into per-sensor columns. See
+    `decodeRecords` and `splitColumns`.
+    """
+    return splitColumns(decodeRecords(buf, sensorInfo, report), sensorInfo)
+
+
+def iterBlocks(buf, blockSize=BLOCK_SIZE, sensorInfo=None, report=None,
+               start=0, growing=False):
+    """
+    Decodes `buf` block by block. Only one block of at most `blockSize`
+    records is held in memory at a time, which keeps memory use bounded for
+    arbitrarily large files when used together with `mappedFile`.
+
+    Receives:
+        buffer          buf         Raw journald file contents
+        integer         blockSize   Maximum number of records per block
+        list            sensorInfo  Record description.
+                                    Default: hkdata.thm_bytes
+        DecodeReport    report      Collects decoding statistics, if given
+        integer         start       Offset of the first record to decode
+        boolean         growing     Whether `buf` is still being written to
+                                    (see `iterRecordOffsets`)
+    Yields:
+        dict            columns     Per-sensor columns of one block as
+                                    returned by `splitColumns`
+    """
+    if report is None:
+        report = DecodeReport(sensorInfo)
+    dtype = recordDtype(sensorInfo)
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    for offsets, skipped in iterRecordOffsets(buf, blockSize, sensorInfo,
+                                              start=start, growing=growing):
+        report.addSkipped(skipped)
+        if offsets.size:
+            records = _gather(raw, offsets, dtype)
+            report.addRecords(records, offsets)
+            yield splitColumns(records, sensorInfo)
+
+
+def joinBlocks(blocks):
+    """
+    Joins blocks as yielded by `iterBlocks` into a single set of columns as
+    returned by `decode`.
+    """
+    if not blocks:
+        return {}
+    times = np.concatenate([next(iter(block.values()))[0]
+                            for block in blocks])
+    return dict((name, (times, np.concatenate([block[name][1]
+                                               for block in blocks])))
+                for name in blocks[0])
+
+
+@contextlib.contextmanager
+def mappedFile(fileName):
+    """
+    Memory-maps `fileName` read-only so that it can be decoded straight from
+    the page cache instead of being read into memory first. The map is closed
+    on exit, so no arrays viewing it may be kept beyond the `with` block.
+
+    Receives:
+        string      fileName    File to be mapped
+    Yields:
+        buffer      buf         Memory map of the file (empty bytes object if
+                                the file is empty and cannot be mapped)
+    """
+    with open(fileName, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield buf
+    finally:
+        buf.close()
+
+
+def decodeFile(fileName, sensorInfo=None, report=None):
+    """
+    Decodes a journald THM file through a memory map. See `decode`.
+    """
+    with mappedFile(fileName) as buf:
+        return decode(buf, sensorInfo, report)
+
+
+def columnNames(sensorInfo=None):
+    """
+    Returns the names of the columns produced by `splitColumns`, in record
+    order.
+    """
+    if sensorInfo is None:
+        sensorInfo = hkdata.thm_bytes
+    return [info[0] for info in sensorInfo if info[3] is not None]
+
+
+def shardBoundaries(buf, shards, sensorInfo=None):
+    """
+    Splits `buf` into at most `shards` byte ranges of roughly equal size, each
+    of which starts at a record that a sequential scan of `buf` finds valid.
+    Only the record offsets are scanned, which on intact data is the fast
+    path of `iterRecordOffsets` and takes a small fraction of decoding.
+    Decoding each range with `iterRecordOffsets(buf, start=start,
+    stop=end)` then finds exactly the records of the sequential scan.
+
+    Receives:
+        buffer      buf         Raw journald file contents
+        integer     shards      Desired number of ranges
+        list        sensorInfo  Record description. Default: hkdata.thm_bytes
+    Returns:
+        list        bounds      (start, end) byte ranges covering `buf`
+    """
+    size = len(buf)
+    splits = [size * i // shards for i in range(1, shards)]
+    starts = [0]
+    for offsets, skipped in iterRecordOffsets(buf, BLOCK_SIZE, sensorInfo):
+        while splits and offsets.size and offsets[-1] >= splits[0]:
+            start = int(offsets[np.searchsorted(offsets, splits.pop(0))])
+            if start > starts[-1]:
+                starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+# Shared output of the worker processes of `decodeParallel`
+_shared = {}
+
+
+def _initShard(sharedArray, rows, columns):
+    _shared['columns'] = (sharedArray, rows, columns)
+
+
+def _decodeShard(task):
+    """
+    Decodes the byte range of one shard of a file into the shared output
+    columns, starting at row `base`. Runs in a worker process.
+    """
+    fileName, start, end, base, sensorInfo, traceEvery = task
+    sharedArray, rows, columns = _shared['columns']
+    out = np.frombuffer(sharedArray, dtype=np.float64).reshape(columns, rows)
+    names = columnNames(sensorInfo)
+    dtype = recordDtype(sensorInfo)
+    report = DecodeReport(sensorInfo, traceEvery)
+    count = 0
+    with mappedFile(fileName) as buf:
+        raw = np.frombuffer(buf, dtype=np.uint8)
+        for offsets, skipped in iterRecordOffsets(buf, BLOCK_SIZE, sensorInfo,
+                                                  start=start, stop=end):
+            report.addSkipped(skipped)
+            if offsets.size == 0:
+                continue
+            records = _gather(raw, offsets, dtype)
+            report.addRecords(records, offsets)
+            block = splitColumns(records, sensorInfo)
+            del records
+            row = base + count
+            count += offsets.size
+            out[0, row:base + count] = block[names[0]][0]
+            for i, name in enumerate(names):
+                out[i + 1, row:base + count] = block[name][1]
+            del block
+        del raw
+    return count, report
+
+
+def decodeParallel(fileName, processes=None, sensorInfo=None, report=None):
+    """
+    Decodes a journald THM file with a pool of `processes` worker processes.
+    The file is split into shards at record boundaries. Each worker decodes
+    its shard through its own memory map and writes the columns into shared
+    memory, so the decoded data is never pickled.
+
+    Receives:
+        string          fileName    File to be decoded
+        integer         processes   Number of worker processes. Default:
+                                    number of CPUs
+        list            sensorInfo  Record description.
+                                    Default: hkdata.thm_bytes
+        DecodeReport    report      Collects the statistics of all workers,
+                                    if given
+    Returns:
+        dict            columns     Same as `decode`
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if report is None:
+        report = DecodeReport(sensorInfo)
+    recordSize = recordDtype(sensorInfo).itemsize
+    with mappedFile(fileName) as buf:
+        bounds = shardBoundaries(buf, processes, sensorInfo)
+
+    # Every shard gets as many rows as it could possibly hold records
+    tasks = []
+    rows = 0
+    for start, end in bounds:
+        tasks.append((fileName, start, end, rows, sensorInfo,
+                      report.traceEvery))
+        rows += (end - start) // recordSize
+    if rows == 0:
+        return decode(b'', sensorInfo, report)
+    names = columnNames(sensorInfo)
+    sharedArray = multiprocessing.RawArray('d', rows * (len(names) + 1))
+
+    pool = multiprocessing.Pool(processes, _initShard,
+                                (sharedArray, rows, len(names) + 1))
+    try:
+        results = pool.map(_decodeShard, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    counts = [shardCount for shardCount, shardReport in results]
+    for shardCount, shardReport in results:
+        report.merge(shardReport)
+
+    # Close the gaps between shards in place
+    out = np.frombuffer(sharedArray, dtype=np.float64)
+    out = out.reshape(len(names) + 1, rows)
+    count = 0
+    for task, shardCount in zip(tasks, counts):
+        base = task[3]
+        out[:, count:count + shardCount] = out[:, base:base + shardCount]
+        count += shardCount
+
+    times = out[0, :count]
+    return dict((name, (times, out[i + 1, :count]))
+                for i, name in enumerate(names))
+
+
+def _decodeWholeFile(task):
+    """
+    Decodes one file of `iterDecodeFiles`. Runs in a worker process.
+    """
+    fileName, sensorInfo, traceEvery = task
+    report = DecodeReport(sensorInfo, traceEvery)
+    return fileName, decodeFile(fileName, sensorInfo, report), report
+
+
+def iterDecodeFiles(fileNames, processes=None, sensorInfo=None, traceEvery=0):
+    """
+    Decodes many journald THM files concurrently with a pool of `processes`
+    worker processes, one file per task.
+
+    Receives:
+        list            fileNames   Files to be decoded
+        integer         processes   Number of worker processes. Default:
+                                    number of CPUs
+        list            sensorInfo  Record description.
+                                    Default: hkdata.thm_bytes
+        integer         traceEvery  See `DecodeReport`
+    Yields:
+        string          fileName    Decoded file, in order of completion
+        dict            columns     Same as `decode`
+        DecodeReport    report      Statistics of the file
+    """
+    if not fileNames:
+        return
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(fileNames))
+    tasks = [(fileName, sensorInfo, traceEvery) for fileName in fileNames]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_decodeWholeFile, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
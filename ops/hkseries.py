@@ -0,0 +1,771 @@
+import numpy as np
+
+# Lengths of a minute and of an hour in matplotlib dates (days)
+MINUTE = 1 / (24. * 60)
+HOUR = 1 / 24.
+
+
+def sortSeries(x, y):
+    """
+    Sorts a series by time. Mergesort is stable, so samples sharing a
+    timestamp keep their order. Already sorted series are returned as they
+    are.
+
+    Receives:
+        numpy array x       Timestamps
+        numpy array y       Values
+    Returns:
+        numpy array x       Sorted timestamps
+        numpy array y       Values in the order of the sorted timestamps
+    """
+    if (np.diff(x) < 0).any():
+        p = x.argsort(kind='mergesort')
+        x = x[p]
+        y = y[p]
+    return x, y
+
+
+def mergeSorted(x, y, newx, newy, out=None):
+    """
+    Merges two series that are each sorted by time in linear time. On equal
+    timestamps, samples of the first series come first.
+
+    Receives:
+        numpy array x       Timestamps of the first series
+        numpy array y       Values of the first series
+        numpy array newx    Timestamps of the second series
+        numpy array newy    Values of the second series
+        tuple       out     Timestamp and value arrays of length
+                            x.size + newx.size to merge into. By default,
+                            new arrays are allocated unless one of the
+                            series is empty
+    Returns:
+        numpy array x       Merged timestamps
+        numpy array y       Merged values
+    """
+    if out is None:
+        if newx.size == 0:
+            return x, y
+        if x.size == 0:
+            return newx, newy
+        out = (np.empty(x.size + newx.size, dtype=np.result_type(x, newx)),
+               np.empty(x.size + newx.size, dtype=np.result_type(y, newy)))
+    mergedx, mergedy = out
+    # Position of every new sample in the merged series
+    inds = np.searchsorted(x, newx, side='right') + np.arange(newx.size)
+    old = np.ones(mergedx.size, dtype=bool)
+    old[inds] = False
+    mergedx[inds] = newx
+    mergedy[inds] = newy
+    mergedx[old] = x
+    mergedy[old] = y
+    return mergedx, mergedy
+
+
+def findDuplicates(x, y):
+    """
+    Finds exact duplicates in a series sorted by time, i.e. samples that
+    repeat both the timestamp and the value of an earlier sample.
+
+    Receives:
+        numpy array x       Sorted timestamps
+        numpy array y       Values
+    Returns:
+        numpy array dups    Boolean mask of the duplicates
+    """
+    dups = np.zeros(x.size, dtype=bool)
+    same = x[1:] == x[:-1]
+    if not same.any():
+        return dups
+    # Values sharing a timestamp need not be adjacent, so sort them
+    order = np.lexsort((y, x))
+    sortedx = x[order]
+    sortedy = y[order]
+    repeated = ((sortedx[1:] == sortedx[:-1]) &
+                (sortedy[1:] == sortedy[:-1]))
+    dups[order[1:][repeated]] = True
+    return dups
+
+
+def kwayMerge(runs):
+    """
+    Merges any number of series that are each sorted by time. Runs are merged
+    pairwise in a balanced tree, which takes O(n log k) for n samples in k
+    runs instead of the O(n log n) of sorting their concatenation. On equal
+    timestamps, samples keep the order of the runs they come from.
+
+    Receives:
+        list        runs    (x, y) tuples of sorted numpy arrays
+    Returns:
+        numpy array x       Merged timestamps
+        numpy array y       Merged values
+    """
+    runs = [run for run in runs if run[0].size] or runs[:1]
+    if not runs:
+        return np.zeros(0), np.zeros(0)
+    while len(runs) > 1:
+        merged = [mergeSorted(x, y, newx, newy)
+                  for (x, y), (newx, newy) in zip(runs[::2], runs[1::2])]
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0]
+
+
+def findConflicts(x, y):
+    """
+    Finds the duplicate and conflicting samples of a series sorted by time in
+    one vectorized pass. Samples sharing a timestamp form a group. A group
+    whose values all agree holds duplicates, a group whose values differ is
+    a conflict. NaN values are ignored.
+
+    Receives:
+        numpy array x           Sorted timestamps
+        numpy array y           Values
+    Returns:
+        integer     duplicates  Number of redundant samples in groups without
+                                conflict
+        numpy array times       Timestamps of the conflicting groups
+        numpy array lows        Lowest value of each conflicting group
+        numpy array highs       Highest value of each conflicting group
+    """
+    _, counts, times, lows, highs = _findGroups(x, y)
+    return int(counts.sum()), times, lows, highs
+
+
+def _findGroups(x, y):
+    """
+    Like `findConflicts`, but returns the timestamps of the groups holding
+    duplicates and the number of redundant samples of each instead of
+    their total.
+    """
+    same = x[1:] == x[:-1]
+    if not same.any():
+        empty = np.zeros(0)
+        return empty, np.zeros(0, dtype=np.int64), empty, empty, empty
+    # First sample of every group, and the size of the group
+    starts = np.flatnonzero(np.concatenate(([True], ~same)))
+    sizes = np.diff(np.append(starts, x.size))
+    lows = np.fmin.reduceat(y, starts)
+    highs = np.fmax.reduceat(y, starts)
+
+    shared = sizes > 1
+    starts = starts[shared]
+    sizes = sizes[shared]
+    lows = lows[shared]
+    highs = highs[shared]
+    conflicts = highs > lows
+    return (x[starts[~conflicts]], sizes[~conflicts] - 1,
+            x[starts[conflicts]], lows[conflicts], highs[conflicts])
+
+
+class ConflictReport(object):
+    """
+    Duplicate and conflicting samples of all sensors, as found by
+    `findConflicts`. Samples are duplicates if they agree with another sample
+    of the same sensor in both timestamp and value, and conflicting if they
+    only agree in the timestamp.
+    """
+    def __init__(self):
+        # Number of redundant samples of each sensor
+        self.duplicates = {}
+        # (times, lows, highs) of the conflicting groups of each sensor
+        self.conflicts = {}
+        # (times, redundant samples) of the duplicate groups of each sensor
+        self.duplicateGroups = {}
+
+
+    def add(self, sensor, x, y, start=0):
+        """
+        Checks the series of `sensor` from the sample at `start` on and
+        records its duplicates and conflicts, if any. What was recorded for
+        the timestamps checked before is replaced, so after a merge only
+        the part of the series that may have changed has to be checked (see
+        `Series.merge`).
+
+        Receives:
+            string      sensor  Name of the sensor
+            numpy array x       Sorted timestamps
+            numpy array y       Values
+            integer     start   Index of the first sample to be checked
+        """
+        if start >= len(x):
+            return
+        # The group of the first sample may begin before it
+        start = int(np.searchsorted(x, x[start], side='left'))
+        cutoff = x[start]
+        dupTimes, counts, times, lows, highs = _findGroups(x[start:],
+                                                           y[start:])
+        if sensor in self.duplicateGroups:
+            oldTimes, oldCounts = self.duplicateGroups.pop(sensor)
+            keep = oldTimes < cutoff
+            dupTimes = np.concatenate((oldTimes[keep], dupTimes))
+            counts = np.concatenate((oldCounts[keep], counts))
+        if sensor in self.conflicts:
+            old = self.conflicts.pop(sensor)
+            keep = old[0] < cutoff
+            times, lows, highs = [np.concatenate((column[keep], new))
+                                  for column, new
+                                  in zip(old, (times, lows, highs))]
+        self.duplicates.pop(sensor, None)
+        if dupTimes.size:
+            self.duplicateGroups[sensor] = (dupTimes, counts)
+            self.duplicates[sensor] = int(counts.sum())
+        if times.size:
+            self.conflicts[sensor] = (times, lows, highs)
+
+
+    def copy(self):
+        """
+        Returns a copy that later calls of `add` leave untouched.
+        """
+        report = ConflictReport()
+        report.duplicates = dict(self.duplicates)
+        report.conflicts = dict(self.conflicts)
+        report.duplicateGroups = dict(self.duplicateGroups)
+        return report
+
+
+    def times(self, sensors=None):
+        """
+        Returns the sorted, unique timestamps at which any of `sensors` (by
+        default all sensors) has conflicting values.
+        """
+        if sensors is None:
+            sensors = self.conflicts.keys()
+        times = [self.conflicts[sensor][0] for sensor in sensors
+                 if sensor in self.conflicts]
+        if not times:
+            return np.zeros(0)
+        return np.unique(np.concatenate(times))
+
+
+    def summary(self):
+        return ('{} duplicate samples, {} conflicting timestamps in {} sensors'
+                .format(sum(self.duplicates.values()),
+                        sum(times.size for times, _, _
+                            in self.conflicts.values()),
+                        len(self.conflicts)))
+
+
+def _extrema(y, ymin, ymax):
+    """
+    Updates the running minimum `ymin` and maximum `ymax` with the values
+    `y`, ignoring NaN.
+    """
+    if y.size:
+        ymin = np.fmin(ymin, np.fmin.reduce(y))
+        ymax = np.fmax(ymax, np.fmax.reduce(y))
+    return ymin, ymax
+
+
+def extents(series, left=None, right=None):
+    """
+    Finds the extents of the samples of a series within the time range from
+    `left` to `right`. If the range covers the whole series, the running
+    extrema of the series are used, which takes O(1). Otherwise the range is
+    located with `searchsorted`, which takes O(log n) plus the number of
+    samples in range.
+
+    Receives:
+        Series      series  `Series`, `RetainedSeries` or any (x, y) tuple
+                            of numpy arrays sorted by time
+        float       left    Start of the time range. Default: unbounded
+        float       right   End of the time range. Default: unbounded
+    Returns:
+        tuple       extents (xmin, xmax, ymin, ymax) of the samples in range,
+                            or None if there are none. ymin and ymax are NaN
+                            if all values in range are NaN
+    """
+    x, y = series
+    if len(x) == 0:
+        return None
+    x = np.asarray(x)
+    first = 0 if left is None else int(np.searchsorted(x, left, 'left'))
+    last = x.size if right is None else int(np.searchsorted(x, right,
+                                                            'right'))
+    if first >= last:
+        return None
+    if first == 0 and last == x.size and hasattr(series, 'ymin'):
+        return x[0], x[-1], series.ymin, series.ymax
+    ymin, ymax = _extrema(np.asarray(y)[first:last], np.nan, np.nan)
+    return x[first], x[last - 1], ymin, ymax
+
+
+def combineExtents(allExtents):
+    """
+    Combines the extents of several series as returned by `extents`,
+    skipping None.
+
+    Receives:
+        iterable    allExtents  (xmin, xmax, ymin, ymax) tuples or None
+    Returns:
+        tuple       extents     Combined (xmin, xmax, ymin, ymax), or None if
+                                all extents are None
+    """
+    allExtents = [e for e in allExtents if e is not None]
+    if not allExtents:
+        return None
+    xmins, xmaxs, ymins, ymaxs = zip(*allExtents)
+    return (min(xmins), max(xmaxs), np.fmin.reduce(ymins),
+            np.fmax.reduce(ymaxs))
+
+
+class Series(object):
+    """
+    Growable time series of one sensor. Samples are stored in typed numpy
+    arrays whose capacity doubles whenever they are full, so that appending
+    n samples one block at a time takes amortized O(n) instead of the O(n^2)
+    of concatenating every block to the whole series. The series is kept
+    sorted by time.
+
+    A series unpacks like an (x, y) tuple of views of the stored samples.
+    Views stay valid when the series grows, but do not see samples appended
+    later, and see samples move when earlier ones are merged in (see
+    `merge`). The running extrema of the values are kept in `ymin` and `ymax`
+    (see `extents`).
+    """
+    # Capacity of an empty series
+    minCapacity = 1024
+
+    def __init__(self, x=None, y=None, xdtype=np.float64, ydtype=np.float64):
+        """
+        Receives:
+            numpy array x       Initial timestamps, sorted. Used as storage
+                                without copying if of type `xdtype`
+            numpy array y       Initial values. Used as storage without
+                                copying if of type `ydtype`
+            numpy dtype xdtype  Type of the timestamps (float64 or int64)
+            numpy dtype ydtype  Type of the values (float64 or int64)
+        """
+        if x is None:
+            self._x = np.empty(self.minCapacity, dtype=xdtype)
+            self._y = np.empty(self.minCapacity, dtype=ydtype)
+            self.size = 0
+        else:
+            self._x = np.asarray(x, dtype=xdtype)
+            self._y = np.asarray(y, dtype=ydtype)
+            self.size = self._x.size
+        self.ymin, self.ymax = _extrema(self.y, np.nan, np.nan)
+
+
+    @property
+    def x(self):
+        return self._x[:self.size]
+
+
+    @property
+    def y(self):
+        return self._y[:self.size]
+
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+
+    def __len__(self):
+        return self.size
+
+
+    def reserve(self, size):
+        """
+        Makes room for at least `size` samples, at least doubling the
+        capacity if the series has to grow.
+        """
+        capacity = self._x.size
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, self.minCapacity)
+        x = np.empty(capacity, dtype=self._x.dtype)
+        y = np.empty(capacity, dtype=self._y.dtype)
+        x[:self.size] = self._x[:self.size]
+        y[:self.size] = self._y[:self.size]
+        self._x = x
+        self._y = y
+
+
+    def append(self, x, y):
+        """
+        Appends samples that are not earlier than the last stored sample.
+
+        Receives:
+            numpy array x       Timestamps, sorted
+            numpy array y       Values
+        """
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        end = self.size + x.size
+        self.reserve(end)
+        self._x[self.size:end] = x
+        self._y[self.size:end] = y
+        self.size = end
+        self.ymin, self.ymax = _extrema(y, self.ymin, self.ymax)
+
+
+    def merge(self, x, y, dropDuplicates=False):
+        """
+        Merges samples that are sorted by time into the series. Samples
+        that are not earlier than the last stored sample are appended.
+        Otherwise, only the stored samples after the first new one are merged
+        with them, in place (see `mergeAt`), so the cost is proportional to
+        the new data and the part of the series it overlaps with.
+
+        Receives:
+            numpy array x               Timestamps, sorted
+            numpy array y               Values
+            boolean     dropDuplicates  Whether to drop samples that repeat
+                                        the timestamp and value of another
+                                        one (see `findDuplicates`)
+        Returns:
+            integer     start           Index of the first sample that may
+                                        have changed
+        """
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        if x.size == 0:
+            return self.size
+        start = self.size
+        if self.size == 0 or x[0] >= self._x[self.size - 1]:
+            self.append(x, y)
+        else:
+            start = int(np.searchsorted(self._x[:self.size], x[0],
+                                        side='right'))
+            self.mergeAt(start, x, y)
+
+        if dropDuplicates:
+            # Duplicates may start at the last sample before the new ones
+            start = max(0, start - 1)
+            while start > 0 and self._x[start - 1] == self._x[start]:
+                start -= 1
+            dups = findDuplicates(self._x[start:self.size],
+                                  self._y[start:self.size])
+            if dups.any():
+                keep = ~dups
+                size = start + int(keep.sum())
+                self._x[start:size] = self._x[start:self.size][keep]
+                self._y[start:size] = self._y[start:self.size][keep]
+                self.size = size
+        return start
+
+
+    def mergeAt(self, start, x, y):
+        """
+        Merges samples that are sorted by time and not earlier than the
+        stored sample before `start` with the stored samples from `start` on,
+        in place. Only those are copied, unless the storage has to grow.
+        """
+        size = self.size + x.size
+        self.reserve(size)
+        mergeSorted(self._x[start:self.size].copy(),
+                    self._y[start:self.size].copy(), x, y,
+                    out=(self._x[start:size], self._y[start:size]))
+        self.size = size
+        self.ymin, self.ymax = _extrema(y, self.ymin, self.ymax)
+
+
+class Rollup(object):
+    """
+    Minimum, maximum and mean of a series in bins of `width` time units,
+    each labelled with its start time. The sum and the number of the values
+    of every bin are kept instead of the mean, so bins covering the same
+    time can be combined exactly, whatever the order they arrive in. NaN
+    values are ignored, bins of NaN values only have a NaN mean and extrema.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.x = np.empty(0)
+        self.ymin = np.empty(0)
+        self.ymax = np.empty(0)
+        self.sums = np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+
+
+    def __len__(self):
+        return self.x.size
+
+
+    @property
+    def y(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+
+    def addSamples(self, x, y):
+        """
+        Adds raw samples.
+
+        Receives:
+            numpy array x       Timestamps, sorted
+            numpy array y       Values
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        if not x.size:
+            return
+        bins = np.floor(x / self.width) * self.width
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        valid = ~np.isnan(y)
+        self._add(bins[starts],
+                  np.fmin.reduceat(y, starts),
+                  np.fmax.reduceat(y, starts),
+                  np.add.reduceat(np.where(valid, y, 0), starts),
+                  np.add.reduceat(valid.astype(np.int64), starts))
+
+
+    def addBins(self, x, ymin, ymax, sums, counts, width):
+        """
+        Adds the bins of a finer rollup. Bins that fall into the same bin of
+        this rollup are combined.
+
+        Receives:
+            numpy array x       Start times of the bins, sorted
+            numpy array ymin    Smallest value of every bin
+            numpy array ymax    Largest value of every bin
+            numpy array sums    Sum of the values of every bin
+            numpy array counts  Number of values of every bin
+            float       width   Width of the bins
+        """
+        if not len(x):
+            return
+        # Bin by the centers, which are never close to a boundary, so that
+        # rounding cannot move a bin into the previous one
+        x = np.floor((np.asarray(x) + width / 2.) / self.width) * self.width
+        self._add(x, ymin, ymax, sums, counts)
+
+
+    def _add(self, x, ymin, ymax, sums, counts):
+        if self.x.size and x[0] <= self.x[-1]:
+            # Bins that go back in time: sort everything again
+            x = np.concatenate((self.x, x))
+            order = x.argsort(kind='mergesort')
+            x = x[order]
+            columns = [np.concatenate((old, new))[order] for old, new
+                       in zip((self.ymin, self.ymax, self.sums, self.counts),
+                              (ymin, ymax, sums, counts))]
+        else:
+            # The usual case: the bins continue the rollup
+            columns = [np.concatenate((old, new)) for old, new
+                       in zip((self.ymin, self.ymax, self.sums, self.counts),
+                              (ymin, ymax, sums, counts))]
+            x = np.concatenate((self.x, x))
+        starts = np.flatnonzero(np.r_[True, x[1:] != x[:-1]])
+        if starts.size == x.size:
+            self.x = x
+            self.ymin, self.ymax, self.sums, self.counts = columns
+            return
+        self.x = x[starts]
+        self.ymin = np.fmin.reduceat(columns[0], starts)
+        self.ymax = np.fmax.reduceat(columns[1], starts)
+        self.sums = np.add.reduceat(columns[2], starts)
+        self.counts = np.add.reduceat(columns[3], starts)
+
+
+    def expire(self, cutoff):
+        """
+        Removes the bins that end before `cutoff`.
+
+        Receives:
+            float       cutoff  Timestamp
+        Returns:
+            tuple       bins    The removed bins as (x, ymin, ymax, sums,
+                                counts, width), see `addBins`
+        """
+        n = int(np.searchsorted(self.x, cutoff - self.width, side='right'))
+        bins = (self.x[:n], self.ymin[:n], self.ymax[:n], self.sums[:n],
+                self.counts[:n], self.width)
+        self.x = self.x[n:]
+        self.ymin = self.ymin[n:]
+        self.ymax = self.ymax[n:]
+        self.sums = self.sums[n:]
+        self.counts = self.counts[n:]
+        return bins
+
+
+class RetainedSeries(Series):
+    """
+    Time series of one sensor in live mode, with tiered retention so that
+    its memory and the cost of drawing it stay bounded however long the
+    monitor runs. The samples of the last `fullHours` hours are kept at full
+    resolution. Older ones are rolled up into 1-minute bins, bins older than
+    `minuteHours` hours more into 1-hour bins, which are dropped after
+    `hourHours` hours more (see `Rollup`).
+
+    The arrays of the `Series` hold the means of the hour bins, the means of
+    the minute bins and the full resolution samples, in this order, with
+    every bin placed at its start time so the timestamps stay sorted. Reading
+    the series therefore returns views, and appending takes amortized O(1).
+    Aging is relative to the latest sample, not to the clock: once the oldest
+    full resolution sample is a minute past `fullHours`, the samples past it
+    are rolled up and the arrays rebuilt, which takes O(n) at most once per
+    minute of data. `ymin` and `ymax` cover the samples and bins kept.
+    """
+    def __init__(self, x=None, y=None, xdtype=np.float64, ydtype=np.float64,
+                 fullHours=24, minuteHours=7 * 24, hourHours=30 * 24):
+        """
+        Receives:
+            numpy array x           Initial timestamps, sorted
+            numpy array y           Initial values
+            numpy dtype xdtype      Type of the timestamps
+            numpy dtype ydtype      Type of the values
+            float       fullHours   Hours kept at full resolution
+            float       minuteHours Hours kept in 1-minute bins after that
+            float       hourHours   Hours kept in 1-hour bins after that,
+                                    or None to keep them all
+        """
+        self.fullRange = fullHours * HOUR
+        self.minuteRange = minuteHours * HOUR
+        self.hourRange = None if hourHours is None else hourHours * HOUR
+        self.minutes = Rollup(MINUTE)
+        self.hours = Rollup(HOUR)
+        # Number of bins at the start of the arrays
+        self.rolled = 0
+        super(RetainedSeries, self).__init__(xdtype=xdtype, ydtype=ydtype)
+        if x is not None:
+            self.append(x, y)
+
+
+    @property
+    def fullx(self):
+        return self._x[self.rolled:self.size]
+
+
+    @property
+    def fully(self):
+        return self._y[self.rolled:self.size]
+
+
+    def state(self):
+        """
+        Copies the contents of the series into arrays, from which
+        `fromState` rebuilds it. The copies take O(n) with n the number of
+        samples and bins kept, but no Python loop.
+
+        Returns:
+            dict        state   Array names as keys and arrays as values
+        """
+        state = {'x': self.fullx.copy(), 'y': self.fully.copy()}
+        for name, rollup in (('minutes', self.minutes), ('hours', self.hours)):
+            state[name] = np.vstack((rollup.x, rollup.ymin, rollup.ymax,
+                                     rollup.sums, rollup.counts))
+        hourRange = np.nan if self.hourRange is None else self.hourRange
+        state['info'] = np.array([self.fullRange, self.minuteRange,
+                                  hourRange, self.ymin, self.ymax])
+        return state
+
+
+    @classmethod
+    def fromState(cls, state):
+        """
+        Rebuilds a series from the arrays returned by `state`.
+        """
+        fullRange, minuteRange, hourRange = state['info'][:3]
+        series = cls(xdtype=state['x'].dtype, ydtype=state['y'].dtype,
+                     fullHours=fullRange / HOUR,
+                     minuteHours=minuteRange / HOUR,
+                     hourHours=None if np.isnan(hourRange)
+                     else hourRange / HOUR)
+        for name in ('minutes', 'hours'):
+            rollup = getattr(series, name)
+            rollup.x, rollup.ymin, rollup.ymax, rollup.sums, counts = \
+                state[name]
+            rollup.counts = counts.astype(np.int64)
+        series._rebuild(state['x'], state['y'])
+        series._age()
+        return series
+
+
+    def _rebuild(self, x, y):
+        """
+        Writes the means of the bins and the full resolution samples `x`,
+        `y` to new arrays, which leaves existing views untouched, and
+        recomputes the extrema.
+        """
+        size = len(self.hours) + len(self.minutes) + x.size
+        capacity = max(2 * size, self.minCapacity)
+        self._x = np.empty(capacity, dtype=self._x.dtype)
+        self._y = np.empty(capacity, dtype=self._y.dtype)
+        self.rolled = size - x.size
+        self._x[:self.rolled] = np.concatenate((self.hours.x, self.minutes.x))
+        self._y[:self.rolled] = np.concatenate((self.hours.y, self.minutes.y))
+        self._x[self.rolled:size] = x
+        self._y[self.rolled:size] = y
+        self.size = size
+        self.ymin, self.ymax = _extrema(y, np.nan, np.nan)
+        for rollup in (self.minutes, self.hours):
+            if len(rollup):
+                self.ymin = np.fmin(self.ymin, np.fmin.reduce(rollup.ymin))
+                self.ymax = np.fmax(self.ymax, np.fmax.reduce(rollup.ymax))
+
+
+    def append(self, x, y):
+        super(RetainedSeries, self).append(x, y)
+        self._age()
+
+
+    def merge(self, x, y):
+        """
+        Merges samples that are sorted by time into the series. Samples
+        that are not earlier than the last stored sample are appended. The
+        rare late ones are merged in place with the stored samples after the
+        first of them (see `Series.mergeAt`), which costs O(k + m) for k late
+        samples and m stored samples after them. Late samples that are
+        earlier than all full resolution samples go straight into the
+        rollups: into the minute bins if they are not earlier than the first
+        of them, otherwise into the hour bins, so the timestamps stay sorted.
+        Those whose hour bin is past the retention are dropped.
+
+        Receives:
+            numpy array x       Timestamps, sorted
+            numpy array y       Values
+        """
+        x = np.atleast_1d(x)
+        y = np.atleast_1d(y)
+        if x.size == 0:
+            return
+        if self.size == 0 or x[0] >= self._x[self.size - 1]:
+            self.append(x, y)
+            return
+        first = self._x[self.rolled] if self.size > self.rolled else np.inf
+        if self.rolled and x[0] < first:
+            rolled = int(np.searchsorted(x, first))
+            if len(self.minutes):
+                split = self.minutes.x[0]
+            else:
+                split = self.hours.x[-1] + HOUR
+            hourly = int(np.searchsorted(x[:rolled], split))
+            self.hours.addSamples(x[:hourly], y[:hourly])
+            if self.hourRange is not None:
+                self.hours.expire(self._x[self.size - 1] - self.fullRange -
+                                  self.minuteRange - self.hourRange)
+            self.minutes.addSamples(x[hourly:rolled], y[hourly:rolled])
+            self._rebuild(self.fullx, self.fully)
+            x = x[rolled:]
+            y = y[rolled:]
+        if x.size:
+            self.mergeAt(self.rolled + int(np.searchsorted(self.fullx, x[0],
+                                                           side='right')),
+                         x, y)
+        self._age()
+
+
+    def _age(self):
+        """
+        Rolls up the samples and bins that aged out of their tier.
+        """
+        if self.size == self.rolled:
+            return
+        cutoff = self._x[self.size - 1] - self.fullRange
+        if self._x[self.rolled] > cutoff - MINUTE:
+            return
+        fullx = self.fullx
+        fully = self.fully
+        aged = int(np.searchsorted(fullx, cutoff))
+        self.minutes.addSamples(fullx[:aged], fully[:aged])
+        cutoff -= self.minuteRange
+        if len(self.minutes) and self.minutes.x[0] <= cutoff - MINUTE:
+            self.hours.addBins(*self.minutes.expire(cutoff))
+        if self.hourRange is not None:
+            cutoff -= self.hourRange
+            if len(self.hours) and self.hours.x[0] <= cutoff - HOUR:
+                self.hours.expire(cutoff)
+        self._rebuild(fullx[aged:], fully[aged:])
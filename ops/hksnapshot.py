@@ -0,0 +1,90 @@
+import logging
+import os
+
+import numpy as np
+
+import hkseries
+
+# Location of the live data snapshot of every mode
+SNAPSHOT_FILE = 'snapshot_{}.npz'
+
+
+def snapshotFile(mode):
+    """
+    Returns the default location of the snapshot of `mode`, so the data of
+    one mode never replaces or resumes that of another.
+    """
+    return SNAPSHOT_FILE.format(mode)
+
+
+def capture(data, mode):
+    """
+    Copies the live data into arrays that `save` can write, e.g. from
+    another thread while the live data keeps changing.
+
+    Receives:
+        dict        data    Sensor names as keys and `hkseries.RetainedSeries`
+                            as values
+        string      mode    Mode the data was received in, e.g. 'fm'
+    Returns:
+        dict        arrays  Array names as keys and arrays as values
+    """
+    sensors = sorted(data)
+    arrays = {'mode': np.array(mode).astype('U'),
+              'sensors': np.array(sensors).astype('U')}
+    for i, sensor in enumerate(sensors):
+        for name, array in data[sensor].state().items():
+            arrays['{}_{}'.format(name, i)] = array
+    return arrays
+
+
+def save(arrays, fileName):
+    """
+    Writes arrays returned by `capture` to an uncompressed `.npz` file. The
+    arrays are written to a temporary file first, which then replaces
+    `fileName`, so a crash never leaves a partially written snapshot behind.
+    """
+    tmpPath = fileName + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmpPath, fileName)
+
+
+def load(mode, fileName=None):
+    """
+    Restores the live data from a snapshot. A snapshot of another mode is
+    refused.
+
+    Receives:
+        string      mode        Mode to resume, e.g. 'fm'
+        string      fileName    Snapshot written by `save`, by default the
+                                one of `mode` (see `snapshotFile`)
+    Returns:
+        dict        data        Sensor names as keys and
+                                `hkseries.RetainedSeries` as values, or None
+                                if the snapshot could not be read or is of
+                                another mode
+    """
+    if fileName is None:
+        fileName = snapshotFile(mode)
+    if not os.path.isfile(fileName):
+        logging.error('No snapshot to resume from at {}'.format(fileName))
+        return None
+    data = {}
+    try:
+        with np.load(fileName) as snapshot:
+            arrays = dict((name, snapshot[name]) for name in snapshot.files)
+        if str(arrays['mode']) != mode:
+            logging.error('Snapshot {} is of mode {}, not {}'
+                          .format(fileName, arrays['mode'], mode))
+            return None
+        for i, sensor in enumerate(arrays['sensors']):
+            state = dict((name, arrays['{}_{}'.format(name, i)])
+                         for name in ('x', 'y', 'minutes', 'hours', 'info'))
+            data[str(sensor)] = hkseries.RetainedSeries.fromState(state)
+    except (IOError, ValueError, KeyError) as e:
+        logging.error('Could not read snapshot {}: {}'.format(fileName, e))
+        return None
+    logging.info('Restored {} sensors from snapshot {}'
+                 .format(len(data), fileName))
+    return data
@@ -0,0 +1,147 @@
+import collections
+import math
+
+# Length of a minute in matplotlib dates (days)
+MINUTE = 1 / (24. * 60)
+
+# Sensors that report system states rather than temperatures
+STATE_SENSORS = ('THM System State', 'State', 'System State')
+
+
+class SlidingRange(object):
+    """
+    Minimum and maximum of the samples of the last `width` time units. The
+    samples are kept in a deque together with two monotonic deques, one of
+    increasing and one of decreasing values, whose first entries are the
+    current minimum and maximum. Adding a sample in time order takes O(1)
+    amortized. A sample that arrives out of order rebuilds the window.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.samples = collections.deque()
+        self.mins = collections.deque()
+        self.maxs = collections.deque()
+
+
+    def add(self, t, y):
+        """
+        Adds the sample (`t`, `y`) and drops the samples that are `width` or
+        more older than the latest one. NaN values are ignored.
+        """
+        if math.isnan(y):
+            return
+        if self.samples and t < self.samples[-1][0]:
+            if t <= self.samples[-1][0] - self.width:
+                return
+            samples = sorted(list(self.samples) + [(t, y)])
+            self.samples.clear()
+            self.mins.clear()
+            self.maxs.clear()
+            for sample in samples:
+                self._push(*sample)
+            return
+        self._push(t, y)
+
+
+    def _push(self, t, y):
+        self.samples.append((t, y))
+        while self.mins and self.mins[-1][1] >= y:
+            self.mins.pop()
+        self.mins.append((t, y))
+        while self.maxs and self.maxs[-1][1] <= y:
+            self.maxs.pop()
+        self.maxs.append((t, y))
+
+        cutoff = t - self.width
+        while self.samples[0][0] <= cutoff:
+            self.samples.popleft()
+        while self.mins[0][0] <= cutoff:
+            self.mins.popleft()
+        while self.maxs[0][0] <= cutoff:
+            self.maxs.popleft()
+
+
+    def range(self):
+        """
+        Returns the difference between the largest and the smallest value in
+        the window, or None if it is empty.
+        """
+        if not self.samples:
+            return None
+        return self.maxs[0][1] - self.mins[0][1]
+
+
+class SteadyStateDetector(object):
+    """
+    Streaming steady state detection. A sensor is in steady state if its
+    values varied by less than `threshold` over the last `timeRange` minutes
+    before its latest sample. Each sensor has its own `SlidingRange`.
+    """
+    def __init__(self, threshold, timeRange):
+        """
+        Receives:
+            float       threshold   Largest variation in steady state
+            float       timeRange   Length of the window in minutes
+        """
+        self.threshold = threshold
+        self.timeRange = timeRange
+        self.windows = {}
+        # Last state of every sensor. Sensors start out not steady
+        self.steady = {}
+
+
+    def add(self, sensor, times, values):
+        """
+        Adds the samples of `sensor` to its window.
+
+        Receives:
+            string      sensor  Name of the sensor
+            iterable    times   Timestamps (matplotlib dates)
+            iterable    values  Values
+        Returns:
+            boolean     steady  The new state of `sensor` if it changed,
+                                otherwise None
+        """
+        if sensor in STATE_SENSORS:
+            return None
+        if sensor not in self.windows:
+            self.windows[sensor] = SlidingRange(self.timeRange * MINUTE)
+        window = self.windows[sensor]
+        for t, y in zip(times, values):
+            window.add(float(t), float(y))
+
+        valueRange = window.range()
+        if valueRange is None:
+            return None
+        steady = valueRange < self.threshold
+        if steady == self.steady.get(sensor, False):
+            return None
+        self.steady[sensor] = steady
+        return steady
+
+
+    def configure(self, threshold, timeRange, history):
+        """
+        Changes the steady state definition. The windows are refilled from
+        `history`, which must hold at least the last `timeRange` minutes of
+        every sensor.
+
+        Receives:
+            float       threshold   Largest variation in steady state
+            float       timeRange   Length of the window in minutes
+            dict        history     Sensor names as keys and (times, values)
+                                    tuples as values
+        Returns:
+            dict        changes     Sensor names as keys and new states as
+                                    values for every sensor whose state
+                                    changed
+        """
+        self.threshold = threshold
+        self.timeRange = timeRange
+        self.windows = {}
+        changes = {}
+        for sensor, (times, values) in history.items():
+            steady = self.add(sensor, times, values)
+            if steady is not None:
+                changes[sensor] = steady
+        return changes
@@ -0,0 +1,82 @@
+import numpy as np
+
+import hkseries
+
+# Length of a minute in matplotlib dates (days)
+MINUTE = hkseries.MINUTE
+
+
+class LiveView(object):
+    """
+    Decides when the view of the live graphs has to move. Only the data
+    that arrived since the previous frame is compared with the current
+    limits, so the limits, and with them the background the live graphs are
+    blitted onto, stay put until new data leaves the view. With a window
+    width, the view then slides to the latest data and leaves a tenth of
+    the width free for the data to come, so it moves once every tenth of the
+    width. Without one, it grows to the right. The y-limits fit the data
+    within the new x-limits.
+
+    Samples that arrive later than newer ones were already checked are not
+    compared with the limits.
+    """
+    def __init__(self):
+        # Window width the view was last adjusted to, or False if it never
+        # was
+        self.xLimit = False
+        # Latest timestamp that was compared with the limits
+        self.checkedUntil = None
+
+
+    def adjust(self, data, xlim, ylim, xLimit):
+        """
+        Checks the data that arrived since the previous call against the
+        limits. Takes O(log n) per sensor plus the number of new samples,
+        and O(log n) plus the number of samples in view when the view moves.
+
+        Receives:
+            dict        data    Sensor names as keys and `hkseries.Series`
+                                or `hkseries.RetainedSeries` as values
+            tuple       xlim    Current (left, right) limits (matplotlib
+                                dates)
+            tuple       ylim    Current (bottom, top) limits
+            float       xLimit  Window width in minutes, or None
+        Returns:
+            tuple       limits  New (xlim, ylim), or None if the view does
+                                not have to move
+        """
+        extents = hkseries.combineExtents(hkseries.extents(series)
+                                          for series in data.values())
+        if extents is None:
+            return None
+        new = hkseries.combineExtents(hkseries.extents(series,
+                                                       self.checkedUntil)
+                                      for series in data.values())
+        self.checkedUntil = extents[1]
+        left, right = xlim
+        bottom, top = ylim
+        if xLimit == self.xLimit and (
+                new is None or
+                # NaN extrema (no valid values yet) compare as in view
+                (new[1] <= right and not new[2] < bottom and
+                 not new[3] > top)):
+            return None
+        self.xLimit = xLimit
+
+        xmin, xmax = extents[:2]
+        if xmin == xmax:
+            xlim = (xmax - 5 * MINUTE, xmax + MINUTE)
+        elif xLimit and xmax - left > xLimit * MINUTE:
+            right = xmax + xLimit * MINUTE / 10
+            xlim = (right - xLimit * MINUTE, right)
+        else:
+            padRight = (xmax - left) / 20 if xmax > left else 5 * MINUTE
+            xlim = (left, xmax + padRight)
+
+        visible = hkseries.combineExtents(hkseries.extents(series, *xlim)
+                                          for series in data.values())
+        if visible is not None and not np.isnan(visible[2]):
+            ymin, ymax = visible[2:]
+            ypad = abs(ymax - ymin) * 0.05 or 1
+            ylim = (ymin - ypad, ymax + ypad)
+        return xlim, ylim
@@ -1,34 +1,318 @@
+import collections
+import functools
+import logging
+import threading
+import time
+
 import pika
 import json
 
+# Receive the messages from all subsystems
+ROUTING_KEYS = ["CDH", "HORST", "ADCS", "THM", "EPS", "COM", "PL"]
+
+
+def readConfig(config):
+    """
+    Reads a RabbitMQ configuration, given as the name of a JSON file or as a
+    dict.
+    """
+    if isinstance(config, dict):
+        return config
+    with open(config) as f:
+        return json.load(f)
+
+
+class ConsumerMetrics(object):
+    """
+    Counters of an `AsyncRabbitMQClient`. They are updated by the consumer's
+    thread and may be read from any other.
+    """
+    def __init__(self, window=10):
+        """
+        Receives:
+            int         window  Seconds over which `rate` is averaged
+        """
+        self.window = window
+        self.messages = 0
+        self.acks = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.connected = False
+        self.lock = threading.Lock()
+        # [second, number of messages] of the last `window` seconds
+        self.seconds = collections.deque()
+
+
+    def addMessage(self):
+        now = int(time.time())
+        with self.lock:
+            self.messages += 1
+            if self.seconds and self.seconds[-1][0] == now:
+                self.seconds[-1][1] += 1
+            else:
+                self.seconds.append([now, 1])
+            while self.seconds[0][0] <= now - self.window:
+                self.seconds.popleft()
+
+
+    def rate(self):
+        """
+        Returns the number of messages per second over the last `window`
+        seconds.
+        """
+        start = time.time() - self.window
+        with self.lock:
+            count = sum(n for second, n in self.seconds if second >= start)
+        return count / float(self.window)
+
+
+    def summary(self):
+        return ('{} messages ({:.1f}/s), {} acknowledged, {} failed, {} '
+                'reconnects, {}'.format(self.messages, self.rate(), self.acks,
+                                        self.errors, self.reconnects,
+                                        'connected' if self.connected
+                                        else 'disconnected'))
+
+
+class AsyncRabbitMQClient(object):
+    """
+    Event-loop based consumer on top of pika's `SelectConnection`. It
+    acknowledges messages, so the broker never has more than `prefetch`
+    unacknowledged messages in flight. Acknowledgements are
+    batched: a single ack covers all messages up to the latest one and is
+    sent after `ackEvery` messages or `ackInterval` seconds, whichever comes
+    first. Heartbeats are negotiated every `heartbeat` seconds.
+
+    When the connection is lost or cannot be opened, the client reconnects
+    after a delay that doubles from `minBackoff` up to `maxBackoff` seconds
+    and is reset by the next successful connection. Exchange, queue and
+    bindings are declared again on every connection. Unacknowledged messages
+    are redelivered by the broker, so a message may be handled twice, but
+    never lost.
+
+    The counters in `metrics` are logged every `metricsInterval` seconds,
+    along with the string returned by `messageSummary`, if given, e.g. the
+    counters of the message parser.
+    The optional keys "prefetch", "ackEvery", "ackInterval" and "heartbeat"
+    of the configuration override the arguments. `connect` creates the
+    connection; it defaults to `pika.SelectConnection` and may be replaced,
+    e.g. by an in-process broker in tests.
+    """
+    def __init__(self, config, prefetch=200, ackEvery=None, ackInterval=0.5,
+                 heartbeat=30, minBackoff=1, maxBackoff=60, metricsInterval=60,
+                 messageSummary=None, connect=None):
+        recv = readConfig(config)
+        self.exchange = recv['exchange']
+        self.queue = recv['bindingKey']
+        self.prefetch = recv.get('prefetch', prefetch)
+        # Acknowledging only when all prefetched messages arrived would stall
+        # the consumer
+        self.ackEvery = recv.get('ackEvery',
+                                 ackEvery or max(1, self.prefetch // 2))
+        self.ackInterval = recv.get('ackInterval', ackInterval)
+        self.parameters = pika.ConnectionParameters(
+            host=recv['hostname'], port=recv['port'],
+            credentials=pika.PlainCredentials(recv['user'], recv['pass']),
+            heartbeat=recv.get('heartbeat', heartbeat))
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.backoff = minBackoff
+        self.connect = connect or self.selectConnection
+        self.metrics = ConsumerMetrics()
+        self.metricsInterval = metricsInterval
+        self.messageSummary = messageSummary
+        self.callback = None
+        self.connection = None
+        self.channel = None
+        self.stopping = False
+        # Delivery tag of the last message and number of messages not yet
+        # acknowledged
+        self.lastTag = None
+        self.unacked = 0
+        # Pending timeouts (see `addTimeout`) by key, as (deadline, callback)
+        self.timeouts = {}
+        self.timeoutCount = 0
+
+
+    @staticmethod
+    def selectConnection(parameters, onOpen, onOpenError, onClose):
+        return pika.SelectConnection(parameters,
+                                     on_open_callback=onOpen,
+                                     on_open_error_callback=onOpenError,
+                                     on_close_callback=onClose,
+                                     stop_ioloop_on_close=False)
 
-class RabbitMQClient:
-    def __init__(self, config_file):
-        with open(config_file) as f:
-            recv = json.load(f)
-
-        hostname = recv['hostname']
-        port = recv['port']
-        exchange = recv['exchange']
-        bindingKey = recv['bindingKey']
-        user = recv['user']
-        password = recv['pass']
-
-        self.queue = bindingKey
-        credentials = pika.PlainCredentials(user, password)
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(
-            host=hostname, port=port, credentials=credentials))
-        self.channel = self.connection.channel()
-        self.channel.exchange_declare(exchange=exchange, exchange_type='direct')
-        self.channel.queue_declare(queue=self.queue, durable=True)
-
-        # Receive the messages from all subsystems
-        keys = ["CDH", "HORST", "ADCS", "THM", "EPS", "COM", "PL"]
-        for routing_key in keys:
-            self.channel.queue_bind(exchange=exchange,
-                               queue=self.queue,
-                               routing_key=routing_key)
 
     def start(self, callback):
-        self.channel.basic_consume(callback, self.queue, no_ack=True)
-        self.channel.start_consuming()
+        """
+        Consumes messages until `stop` is called. `callback` is invoked with
+        the channel, method, properties and body of every message, like a
+        pika consumer callback.
+        """
+        self.callback = callback
+        while not self.stopping:
+            self.connection = self.connect(self.parameters,
+                                           self.onConnectionOpen,
+                                           self.onConnectionOpenError,
+                                           self.onConnectionClosed)
+            self.connection.ioloop.start()
+            self.metrics.connected = False
+            if self.stopping:
+                break
+            logging.warning('Reconnecting to RabbitMQ in {} s'
+                            .format(self.backoff))
+            time.sleep(self.backoff)
+            self.backoff = min(2 * self.backoff, self.maxBackoff)
+            self.metrics.reconnects += 1
+
+
+    def stop(self):
+        """
+        Acknowledges the messages handled so far and closes the connection.
+        May be called from any thread.
+        """
+        self.stopping = True
+        if self.connection is not None:
+            self.connection.add_callback_threadsafe(self.close)
+
+
+    def close(self):
+        self.ack()
+        if self.channel is not None:
+            self.channel.close()
+        self.connection.close()
+
+
+    def onConnectionOpen(self, connection):
+        logging.info('Connected to RabbitMQ')
+        self.backoff = self.minBackoff
+        self.metrics.connected = True
+        connection.channel(on_open_callback=self.onChannelOpen)
+        connection.add_timeout(self.metricsInterval, self.onMetricsTimer)
+        for key in list(self.timeouts):
+            self.armTimeout(key)
+
+
+    def addTimeout(self, delay, callback):
+        """
+        Calls `callback` on the consumer's thread after `delay` seconds.
+        Unlike the timeouts of a connection, it is not lost when the
+        connection is: timeouts still pending then are set again on the next
+        connection, and run as soon as it is open if they are overdue. Must be
+        called from the consumer's thread, e.g. from the message callback.
+        """
+        self.timeoutCount += 1
+        self.timeouts[self.timeoutCount] = (time.time() + delay, callback)
+        if self.connection is not None and not self.connection.is_closed:
+            self.armTimeout(self.timeoutCount)
+
+
+    def armTimeout(self, key):
+        deadline = self.timeouts[key][0]
+        self.connection.add_timeout(max(0, deadline - time.time()),
+                                    functools.partial(self.onTimeout, key))
+
+
+    def onTimeout(self, key):
+        # A timeout set on several connections only runs once
+        timeout = self.timeouts.pop(key, None)
+        if timeout is not None:
+            timeout[1]()
+
+
+    def onConnectionOpenError(self, connection, *args):
+        logging.error('Could not connect to RabbitMQ: {}'.format(args))
+        connection.ioloop.stop()
+
+
+    def onConnectionClosed(self, connection, *args):
+        self.channel = None
+        if not self.stopping:
+            logging.error('Lost connection to RabbitMQ: {}; {}'
+                          .format(args, self.metrics.summary()))
+        connection.ioloop.stop()
+
+
+    def onChannelOpen(self, channel):
+        self.channel = channel
+        self.lastTag = None
+        self.unacked = 0
+        channel.add_on_close_callback(self.onChannelClosed)
+        channel.exchange_declare(callback=self.onExchangeDeclared,
+                                 exchange=self.exchange,
+                                 exchange_type='direct')
+
+
+    def onChannelClosed(self, channel, *args):
+        self.channel = None
+        if not self.stopping:
+            logging.error('RabbitMQ channel closed: {}'.format(args))
+            if not (self.connection.is_closed or
+                    self.connection.is_closing):
+                self.connection.close()
+
+
+    def onExchangeDeclared(self, frame):
+        self.channel.queue_declare(callback=self.onQueueDeclared,
+                                   queue=self.queue, durable=True)
+
+
+    def onQueueDeclared(self, frame, keys=None):
+        # Bind the routing keys one after another
+        if keys is None:
+            keys = list(ROUTING_KEYS)
+        if keys:
+            self.channel.queue_bind(callback=functools.partial(
+                                        self.onQueueDeclared, keys=keys[1:]),
+                                    queue=self.queue,
+                                    exchange=self.exchange,
+                                    routing_key=keys[0])
+        else:
+            self.channel.basic_qos(callback=self.onQosSet,
+                                   prefetch_count=self.prefetch)
+
+
+    def onQosSet(self, frame):
+        self.channel.basic_consume(self.onMessage, self.queue)
+        self.connection.add_timeout(self.ackInterval, self.onAckTimer)
+
+
+    def onMessage(self, channel, method, properties, body):
+        self.metrics.addMessage()
+        try:
+            self.callback(channel, method, properties, body)
+        except Exception:
+            # A message that cannot be handled would only be redelivered
+            self.metrics.errors += 1
+            logging.exception('Could not handle message')
+        self.lastTag = method.delivery_tag
+        self.unacked += 1
+        if self.unacked >= self.ackEvery:
+            self.ack()
+
+
+    def ack(self):
+        """
+        Acknowledges all messages up to the last one.
+        """
+        if self.unacked and self.channel is not None:
+            self.channel.basic_ack(delivery_tag=self.lastTag, multiple=True)
+            self.metrics.acks += self.unacked
+            self.unacked = 0
+
+
+    def onAckTimer(self):
+        if self.channel is None:
+            return
+        self.ack()
+        self.connection.add_timeout(self.ackInterval, self.onAckTimer)
+
+
+    def onMetricsTimer(self):
+        if self.connection.is_closed:
+            return
+        logging.info('RabbitMQ consumer: {}'.format(self.metrics.summary()))
+        if self.messageSummary is not None:
+            logging.info('RabbitMQ messages: {}'
+                         .format(self.messageSummary()))
+        self.connection.add_timeout(self.metricsInterval, self.onMetricsTimer)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules of ops/ import each other as top-level modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'ops'))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,297 @@
+import collections
+import functools
+import heapq
+import threading
+import time
+
+
+class LocalBroker(object):
+    """
+    In-process stand-in for a RabbitMQ broker, to test
+    `rabbitmq.AsyncRabbitMQClient` without a server. `connect` creates
+    connections with the part of pika's `SelectConnection` interface that
+    the client uses. The broker routes messages through direct exchanges
+    to durable queues, honours prefetch limits and acknowledgements, and
+    redelivers unacknowledged messages when a connection is lost.
+
+    Messages are published with `publish` from any thread. `disconnect`
+    drops all connections like a broker hiccup and `refuse` makes the next
+    connection attempts fail.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Queues bound to (exchange, routing key)
+        self.bindings = collections.defaultdict(set)
+        # Messages of each queue as (exchange, routing key, properties,
+        # body, redelivered) tuples
+        self.queues = {}
+        self.connections = []
+        self.refusals = 0
+        # (delivery tag, multiple) of every acknowledgement received
+        self.acks = []
+
+
+    def connect(self, parameters, onOpen, onOpenError, onClose):
+        connection = _LocalConnection(self, onClose)
+        with self.condition:
+            if self.refusals:
+                self.refusals -= 1
+                connection.closed = True
+                connection.ioloop.addCallback(onOpenError, connection,
+                                              'connection refused')
+            else:
+                self.connections.append(connection)
+                connection.ioloop.addCallback(onOpen, connection)
+        return connection
+
+
+    def publish(self, exchange, routingKey, body, properties=None):
+        with self.condition:
+            for queue in self.bindings[(exchange, routingKey)]:
+                self.queues[queue].append((exchange, routingKey, properties,
+                                           body, False))
+            self.condition.notify_all()
+
+
+    def disconnect(self):
+        with self.condition:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.add_callback_threadsafe(functools.partial(
+                connection.close, 320, 'CONNECTION_FORCED'))
+
+
+    def refuse(self, count):
+        with self.condition:
+            self.refusals += count
+
+
+    def pending(self, queue):
+        """
+        Returns the number of messages of `queue` that were not delivered.
+        """
+        with self.condition:
+            return len(self.queues.get(queue, ()))
+
+
+class _LocalIOLoop(object):
+    """
+    Event loop of a `LocalBroker` connection: callbacks, timers and message
+    deliveries, all run on the thread that called `start`.
+    """
+    def __init__(self, broker, connection):
+        self.broker = broker
+        self.connection = connection
+        self.callbacks = collections.deque()
+        self.timers = []
+        self.timerCount = 0
+        self.running = False
+
+
+    def addCallback(self, callback, *args):
+        with self.broker.condition:
+            self.callbacks.append(functools.partial(callback, *args))
+            self.broker.condition.notify_all()
+
+
+    def addTimer(self, delay, callback):
+        with self.broker.condition:
+            self.timerCount += 1
+            heapq.heappush(self.timers, (time.time() + delay,
+                                         self.timerCount, callback))
+            self.broker.condition.notify_all()
+
+
+    def start(self):
+        self.running = True
+        while self.running:
+            with self.broker.condition:
+                now = time.time()
+                ready = list(self.callbacks)
+                self.callbacks.clear()
+                while self.timers and self.timers[0][0] <= now:
+                    ready.append(heapq.heappop(self.timers)[2])
+                deliveries = self.connection.takeDeliveries()
+                if not ready and not deliveries:
+                    timeout = (self.timers[0][0] - now if self.timers
+                               else None)
+                    self.broker.condition.wait(timeout)
+                    continue
+            for callback in ready:
+                callback()
+            for deliver in deliveries:
+                deliver()
+
+
+    def stop(self):
+        with self.broker.condition:
+            self.running = False
+            self.broker.condition.notify_all()
+
+
+class _LocalMethod(object):
+    def __init__(self, deliveryTag, exchange, routingKey, redelivered):
+        self.delivery_tag = deliveryTag
+        self.exchange = exchange
+        self.routing_key = routingKey
+        self.redelivered = redelivered
+
+
+class _LocalConnection(object):
+    def __init__(self, broker, onClose):
+        self.broker = broker
+        self.onClose = onClose
+        self.ioloop = _LocalIOLoop(broker, self)
+        self.channels = []
+        self.closed = False
+
+
+    @property
+    def is_closed(self):
+        return self.closed
+
+
+    @property
+    def is_closing(self):
+        return False
+
+
+    def channel(self, on_open_callback):
+        channel = _LocalChannel(self)
+        self.channels.append(channel)
+        self.ioloop.addCallback(on_open_callback, channel)
+        return channel
+
+
+    def add_timeout(self, deadline, callback_method):
+        self.ioloop.addTimer(deadline, callback_method)
+
+
+    def add_callback_threadsafe(self, callback):
+        self.ioloop.addCallback(callback)
+
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if self.closed:
+            return
+        with self.broker.condition:
+            self.closed = True
+            if self in self.broker.connections:
+                self.broker.connections.remove(self)
+        for channel in self.channels:
+            channel.close(reply_code, reply_text)
+        self.ioloop.addCallback(self.onClose, self, reply_code, reply_text)
+
+
+    def takeDeliveries(self):
+        """
+        Takes the messages that may be delivered to the consumers of this
+        connection. Must be called with the broker's condition held.
+        """
+        deliveries = []
+        for channel in self.channels:
+            deliveries.extend(channel.takeDeliveries())
+        return deliveries
+
+
+class _LocalChannel(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.closeCallbacks = []
+        self.consumers = {}
+        self.prefetch = 0
+        self.nextTag = 1
+        # Delivered messages by delivery tag
+        self.unacked = collections.OrderedDict()
+        self.closed = False
+
+
+    def add_on_close_callback(self, callback):
+        self.closeCallbacks.append(callback)
+
+
+    def exchange_declare(self, callback=None, exchange=None,
+                         exchange_type='direct', **kwargs):
+        self.connection.ioloop.addCallback(callback, None)
+
+
+    def queue_declare(self, callback=None, queue='', **kwargs):
+        with self.broker.condition:
+            self.broker.queues.setdefault(queue, collections.deque())
+        self.connection.ioloop.addCallback(callback, None)
+
+
+    def queue_bind(self, callback=None, queue=None, exchange=None,
+                   routing_key=None, **kwargs):
+        with self.broker.condition:
+            self.broker.bindings[(exchange, routing_key)].add(queue)
+        self.connection.ioloop.addCallback(callback, None)
+
+
+    def basic_qos(self, callback=None, prefetch_size=0, prefetch_count=0,
+                  **kwargs):
+        self.prefetch = prefetch_count
+        self.connection.ioloop.addCallback(callback, None)
+
+
+    def basic_consume(self, consumer_callback, queue='', no_ack=False,
+                      **kwargs):
+        with self.broker.condition:
+            self.consumers[queue] = (consumer_callback, no_ack)
+            self.broker.condition.notify_all()
+
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        with self.broker.condition:
+            self.broker.acks.append((delivery_tag, multiple))
+            if multiple:
+                for tag in list(self.unacked):
+                    if tag > delivery_tag:
+                        break
+                    del self.unacked[tag]
+            else:
+                self.unacked.pop(delivery_tag, None)
+            self.broker.condition.notify_all()
+
+
+    def takeDeliveries(self):
+        if self.closed:
+            return []
+        deliveries = []
+        for queue, (callback, noAck) in self.consumers.items():
+            messages = self.broker.queues[queue]
+            while messages and (noAck or not self.prefetch or
+                                len(self.unacked) < self.prefetch):
+                message = messages.popleft()
+                exchange, routingKey, properties, body, redelivered = message
+                tag = self.nextTag
+                self.nextTag += 1
+                if not noAck:
+                    self.unacked[tag] = (queue, message)
+                method = _LocalMethod(tag, exchange, routingKey, redelivered)
+                deliveries.append(functools.partial(
+                    self.deliver, callback, method, properties, body))
+        return deliveries
+
+
+    def deliver(self, callback, method, properties, body):
+        # The channel may have been closed since the message was taken, in
+        # which case the message was requeued
+        if not self.closed:
+            callback(self, method, properties, body)
+
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if self.closed:
+            return
+        with self.broker.condition:
+            self.closed = True
+            # Requeue unacknowledged messages in their original order
+            for queue, message in reversed(list(self.unacked.values())):
+                self.broker.queues[queue].appendleft(message[:4] + (True,))
+            self.unacked.clear()
+            self.broker.condition.notify_all()
+        for callback in self.closeCallbacks:
+            self.connection.ioloop.addCallback(callback, self, reply_code,
+                                               reply_text)
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+import hkarchive
+
+
+def writeSamples(archive, start, count):
+    ids = np.arange(count) % 3
+    timestamps = start + np.arange(count, dtype=float)
+    values = timestamps * 2
+    archive.addColumns(['a', 'b', 'c'], ids, timestamps, values)
+    return timestamps
+
+
+def test_torn_tail_is_cut_off_and_archive_continued(tmpdir):
+    fileName = str(tmpdir.join('raw.hkraw'))
+    archive = hkarchive.RawArchive(fileName, indexInterval=100)
+    first = writeSamples(archive, 0, 1050)
+    archive.close()
+    size = os.path.getsize(fileName)
+    # A sample block cut short by a crash
+    with open(fileName, 'ab') as f:
+        f.write(hkarchive.SAMPLE_BLOCK.pack(hkarchive.SAMPLE, 1, 5e3, 1.)[:7])
+
+    archive = hkarchive.RawArchive(fileName, indexInterval=100)
+    archive._open()
+    assert os.path.getsize(fileName) == size
+    second = writeSamples(archive, 2000, 1050)
+    archive.close()
+
+    columns = hkarchive.readColumns(fileName)
+    times = np.sort(np.concatenate([columns[sensor][0]
+                                    for sensor in 'abc']))
+    assert np.array_equal(times, np.concatenate((first, second)))
+    for sensor in 'abc':
+        assert np.array_equal(columns[sensor][1], columns[sensor][0] * 2)
+    # The index blocks of both sessions chain up for replays from a time
+    replayed = [sample[1] for beacon in hkarchive.replay(fileName, 2500)
+                for sample in beacon]
+    assert replayed == second[500:].tolist()
@@ -0,0 +1,84 @@
+import datetime
+import json
+
+import numpy as np
+
+import hkbeacon
+
+
+def makeSchema():
+    return hkbeacon.BeaconSchema([('A', '<h', None, 0),
+                                  ('B', '<h', None, 1)])
+
+
+def thmBody(**values):
+    payload = {'Beacon Version': 2}
+    payload.update(values)
+    return json.dumps(payload)
+
+
+def test_parser_counts_what_it_drops():
+    parser = hkbeacon.BeaconParser(makeSchema())
+    assert parser.parse('{"A": 1}', 'EPS') is None
+    assert parser.parse('{"A": ', hkbeacon.THM) is None
+    beacon = parser.parse(thmBody(A=1.5, B='hot', C=3, D=4),
+                          hkbeacon.THM)
+    assert beacon.ids.tolist() == [0]
+    assert beacon.values.tolist() == [1.5]
+    # Booleans are integers, but not valid values
+    beacon = parser.parse("{'A': True, 'B': 2}", hkbeacon.THM)
+    assert beacon.ids.tolist() == [1]
+    assert (parser.messagesParsed, parser.messagesMalformed,
+            parser.messagesIgnored, parser.legacyMessages,
+            parser.unknownFields, parser.invalidValues) == (2, 1, 1, 1, 2, 2)
+
+
+def test_parser_rejects_payloads_that_are_not_beacons():
+    parser = hkbeacon.BeaconParser(makeSchema())
+    for body, routingKey in (('[1, 2]', hkbeacon.THM),
+                             ("['A', 1]", hkbeacon.THM),
+                             ('{}', hkbeacon.CDH),
+                             ('{"Beacon Timestamp": 1}', hkbeacon.CDH),
+                             ('{"Beacon Timestamp": "today"}', hkbeacon.CDH)):
+        assert parser.parse(body, routingKey) is None
+    assert parser.messagesMalformed == 5
+    beacon = parser.parse('{"Beacon Timestamp": "2020-01-02T03:04:05"}',
+                          hkbeacon.CDH)
+    assert beacon.timestamp == datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+
+def test_batch_is_due_after_max_beacons_or_max_age():
+    parser = hkbeacon.BeaconParser(makeSchema())
+    beacon = parser.parse(thmBody(A=1), hkbeacon.THM)
+    now = datetime.datetime(2020, 1, 1)
+    batcher = hkbeacon.BeaconBatcher(makeSchema(), maxBeacons=3, maxAge=60)
+    assert not batcher.due()
+    assert [batcher.add(beacon, now) for i in range(3)] == \
+        [False, False, True]
+    batcher.take()
+    assert not batcher.due()
+    assert not batcher.add(beacon, now)
+    # The first beacon of the batch was added a minute ago
+    batcher.started -= 60
+    assert batcher.due()
+    batcher.take()
+    assert batcher.take() is None
+
+
+def test_batch_columns_match_the_beacons():
+    schema = makeSchema()
+    parser = hkbeacon.BeaconParser(schema)
+    batcher = hkbeacon.BeaconBatcher(schema)
+    times = [datetime.datetime(2020, 1, 1, 0, 0, 1, 500000),
+             datetime.datetime(2020, 1, 1, 0, 0, 2)]
+    batcher.add(parser.parse(thmBody(A=1, B=2), hkbeacon.THM), times[0])
+    batcher.add(parser.parse(thmBody(B=3), hkbeacon.THM), times[1])
+    batch = batcher.take()
+    assert (len(batch), batch.beacons) == (3, 2)
+    order = np.lexsort((batch.ids, batch.timestamps))
+    assert batch.ids[order].tolist() == [0, 1, 1]
+    assert batch.values[order].tolist() == [1, 2, 3]
+    assert np.diff(batch.timestamps[order]).tolist() == [0, 0.5]
+    assert sorted(batch.feed()) == [['A', times[0], 1], ['B', times[0], 2],
+                                    ['B', times[1], 3]]
+    assert len(batcher) == 0
@@ -0,0 +1,32 @@
+import os
+
+import hkcache
+import hkdecoder
+from test_hkdecoder import assertSameColumns, makeRecords
+
+
+def test_entry_written_block_by_block_matches_decode(tmpdir):
+    fileName = str(tmpdir.join('thm.bin'))
+    with open(fileName, 'wb') as f:
+        f.write(makeRecords(1000))
+    cache = hkcache.DecodedFileCache(str(tmpdir.join('cache')))
+    writer = cache.writer(fileName)
+    with hkdecoder.mappedFile(fileName) as buf:
+        for columns in hkdecoder.iterBlocks(buf, blockSize=300):
+            writer.add(columns)
+    writer.close()
+    assertSameColumns(cache.load(fileName), hkdecoder.decodeFile(fileName))
+    assert [name for name in os.listdir(cache.directory)
+            if not name.endswith('.npz')] == []
+
+
+def test_discarded_entry_leaves_nothing_behind(tmpdir):
+    fileName = str(tmpdir.join('thm.bin'))
+    with open(fileName, 'wb') as f:
+        f.write(makeRecords(10))
+    cache = hkcache.DecodedFileCache(str(tmpdir.join('cache')))
+    writer = cache.writer(fileName)
+    writer.add(hkdecoder.decodeFile(fileName))
+    writer.discard()
+    assert cache.load(fileName) is None
+    assert os.listdir(cache.directory) == []
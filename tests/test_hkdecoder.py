@@ -0,0 +1,110 @@
+import numpy as np
+
+import hkdecoder
+
+# Raw value whose low byte is a newline, so that every record holds a false
+# record boundary
+NEWLINE_VALUE = 0x090A
+
+
+def makeRecords(count, start=1500000000, step=10):
+    """
+    Returns `count` intact records with constant sensor values, one every
+    `step` seconds from `start` on, as a bytearray.
+    """
+    dtype = hkdecoder.recordDtype()
+    records = np.zeros(count, dtype=dtype)
+    for name in dtype.names:
+        if dtype[name].itemsize == 2:
+            records[name] = NEWLINE_VALUE
+    records['Timestamp'] = start + step * np.arange(count)
+    records['Status'] = 1
+    records[dtype.names[-1]] = hkdecoder.NEWLINE
+    return bytearray(records.tobytes())
+
+
+def assertSameColumns(columns, expected):
+    assert sorted(columns) == sorted(expected)
+    for name in expected:
+        assert np.array_equal(columns[name][0], expected[name][0])
+        assert np.array_equal(columns[name][1], expected[name][1])
+
+
+def test_intact_file_decodes_every_record():
+    buf = makeRecords(1000)
+    offsets, skipped = hkdecoder.scanRecords(bytes(buf))
+    assert np.array_equal(offsets, np.arange(1000) * 84)
+    assert skipped == []
+
+
+def test_corrupted_terminator_skips_only_that_record():
+    buf = makeRecords(2000)
+    buf[4 * 84 + 83] = 0
+    report = hkdecoder.DecodeReport()
+    records = hkdecoder.decodeRecords(bytes(buf), report=report)
+    offsets, skipped = hkdecoder.scanRecords(bytes(buf))
+    assert np.array_equal(offsets, np.delete(np.arange(2000) * 84, 4))
+    assert skipped == [(4 * 84, 5 * 84)]
+    assert np.array_equal(records['Timestamp'],
+                          np.delete(1500000000 + 10 * np.arange(2000), 4))
+    assert report.recordsDecoded == 1999 and report.resyncs == 1
+
+
+def test_resync_after_garbage_prefers_continuous_timestamps():
+    buf = makeRecords(10) + bytearray(b'\x07' * 30) + \
+        makeRecords(10, start=1500000100)
+    offsets, skipped = hkdecoder.scanRecords(bytes(buf))
+    expected = np.concatenate((np.arange(10) * 84,
+                               10 * 84 + 30 + np.arange(10) * 84))
+    assert np.array_equal(offsets, expected)
+    assert skipped == [(840, 870)]
+
+
+def test_clock_reset_keeps_records():
+    buf = makeRecords(10) + makeRecords(10, start=1400000000)
+    offsets, skipped = hkdecoder.scanRecords(bytes(buf))
+    assert offsets.size == 20 and skipped == []
+
+
+def test_truncated_tail_is_skipped():
+    buf = makeRecords(10)[:-20]
+    offsets, skipped = hkdecoder.scanRecords(bytes(buf))
+    assert offsets.size == 9 and skipped == [(9 * 84, 10 * 84 - 20)]
+
+
+def test_blocks_match_whole_decode():
+    buf = makeRecords(1000)
+    buf[300 * 84 + 83] = 0
+    buf = bytes(buf)
+    blocks = list(hkdecoder.iterBlocks(buf, blockSize=64))
+    assertSameColumns(hkdecoder.joinBlocks(blocks), hkdecoder.decode(buf))
+
+
+def test_parallel_decode_matches_sequential(tmpdir):
+    buf = makeRecords(20003)
+    fileName = str(tmpdir.join('intact.bin'))
+    with open(fileName, 'wb') as f:
+        f.write(buf)
+    expected = hkdecoder.decode(bytes(buf))
+    for processes in (2, 3, 4):
+        # Split points off the record grid, some right after a newline
+        assert len(hkdecoder.shardBoundaries(bytes(buf), processes)) == \
+            processes
+        assertSameColumns(hkdecoder.decodeParallel(fileName, processes),
+                          expected)
+
+
+def test_parallel_decode_matches_sequential_on_damaged_file(tmpdir):
+    buf = makeRecords(5000) + bytearray(b'\x07' * 30) + \
+        makeRecords(5000, start=1500050000)
+    buf[7000 * 84 + 30 + 83] = 0
+    fileName = str(tmpdir.join('damaged.bin'))
+    with open(fileName, 'wb') as f:
+        f.write(buf)
+    sequential = hkdecoder.DecodeReport()
+    expected = hkdecoder.decode(bytes(buf), report=sequential)
+    parallel = hkdecoder.DecodeReport()
+    assertSameColumns(hkdecoder.decodeParallel(fileName, 4, report=parallel),
+                      expected)
+    assert parallel.recordsDecoded == sequential.recordsDecoded == 9999
+    assert parallel.bytesSkipped == sequential.bytesSkipped
@@ -0,0 +1,147 @@
+import numpy as np
+
+import hkseries
+
+
+def test_late_samples_are_merged_in_order():
+    rng = np.random.RandomState(0)
+    series = hkseries.RetainedSeries(fullHours=1e6)
+    xs = []
+    ys = []
+    for i in range(2000):
+        x = np.sort(rng.rand(rng.randint(0, 5)) + i * 0.01 * rng.rand())
+        y = rng.rand(x.size)
+        series.merge(x, y)
+        xs.append(x)
+        ys.append(y)
+    x = np.concatenate(xs)
+    y = np.concatenate(ys)
+    order = x.argsort(kind='mergesort')
+    assert np.array_equal(series.x, x[order])
+    assert np.array_equal(series.y, y[order])
+    assert (series.ymin, series.ymax) == (y.min(), y.max())
+
+
+def test_aged_samples_are_rolled_up_by_time():
+    # One sample a minute over 10 days, kept 1 hour at full resolution, 1 day
+    # in minute bins and 2 days in hour bins
+    step = hkseries.MINUTE
+    x = np.arange(10 * 24 * 60) * step + step / 2
+    series = hkseries.RetainedSeries(fullHours=1, minuteHours=24,
+                                     hourHours=48)
+    for start in range(0, x.size, 7):
+        series.append(x[start:start + 7], np.ones(x[start:start + 7].size))
+    latest = x[-1]
+    assert len(series.minutes) and len(series.hours)
+    assert latest - series.fullx[0] <= hkseries.HOUR + step
+    assert series.minutes.x[0] >= latest - 25 * hkseries.HOUR - 2 * step
+    assert series.hours.x[0] >= latest - 74 * hkseries.HOUR - 2 * step
+    assert len(series) == (len(series.hours) + len(series.minutes) +
+                           series.fullx.size)
+    assert (np.diff(series.x) > 0).all()
+    assert np.array_equal(series.y, np.ones(len(series)))
+
+    restored = hkseries.RetainedSeries.fromState(series.state())
+    assert np.array_equal(restored.x, series.x)
+    assert np.array_equal(restored.y, series.y)
+
+
+def test_late_samples_older_than_the_minute_bins_go_to_the_hour_bins():
+    step = hkseries.MINUTE
+    x = np.arange(10 * 24 * 60) * step + step / 2
+    series = hkseries.RetainedSeries(fullHours=1, minuteHours=24,
+                                     hourHours=48)
+    series.append(x, np.ones(x.size))
+    hours = series.hours.counts.sum()
+    minutes = series.minutes.counts.sum()
+    # One sample past the retention, one in the hour bins, one in the minute
+    # bins
+    late = np.array([x[0], series.hours.x[1] + step,
+                     series.minutes.x[1] + step / 4])
+    series.merge(late, np.full(3, 2.))
+    assert (np.diff(series.x) > 0).all()
+    assert series.hours.counts.sum() == hours + 1
+    assert series.minutes.counts.sum() == minutes + 1
+    assert series.ymax == 2
+
+
+def test_kway_merge_is_a_stable_sort_of_the_runs():
+    rng = np.random.RandomState(1)
+    runs = []
+    for size in (0, 5, 40, 1, 17, 0, 33):
+        x = np.sort(rng.randint(0, 20, size)).astype(float)
+        runs.append((x, rng.rand(size)))
+    x, y = hkseries.kwayMerge(runs)
+    allx = np.concatenate([run[0] for run in runs])
+    ally = np.concatenate([run[1] for run in runs])
+    order = np.argsort(allx, kind='stable')
+    assert np.array_equal(x, allx[order])
+    assert np.array_equal(y, ally[order])
+
+
+def test_duplicates_and_conflicts_are_told_apart():
+    x = np.array([1., 2., 2., 2., 3., 4., 4., 5., 5., 5.])
+    y = np.array([1., 2., 2., 2., 3., 4., 6., 5., np.nan, 7.])
+    duplicates, times, lows, highs = hkseries.findConflicts(x, y)
+    # Two redundant samples at 2; 4 and 5 conflict, NaN is ignored
+    assert duplicates == 2
+    assert np.array_equal(times, [4., 5.])
+    assert np.array_equal(lows, [4., 5.])
+    assert np.array_equal(highs, [6., 7.])
+
+    report = hkseries.ConflictReport()
+    report.add('a', x, y)
+    report.add('b', np.array([5., 6., 6.]), np.array([0., 1., 2.]))
+    report.add('c', np.arange(3.), np.arange(3.))
+    assert report.duplicates == {'a': 2}
+    assert sorted(report.conflicts) == ['a', 'b']
+    assert np.array_equal(report.times(), [4., 5., 6.])
+    assert np.array_equal(report.times(['b']), [6.])
+    assert report.summary() == ('2 duplicate samples, 3 conflicting '
+                                'timestamps in 2 sensors')
+
+
+def test_merge_drops_only_exact_duplicates():
+    for dropDuplicates in (False, True):
+        series = hkseries.Series()
+        series.merge(np.array([1., 2., 3.]), np.array([1., 2., 3.]),
+                     dropDuplicates)
+        # Overlaps the stored samples: 2 repeats, 3 conflicts
+        series.merge(np.array([2., 3., 4.]), np.array([2., 9., 4.]),
+                     dropDuplicates)
+        if dropDuplicates:
+            assert np.array_equal(series.x, [1., 2., 3., 3., 4.])
+            assert np.array_equal(series.y, [1., 2., 3., 9., 4.])
+        else:
+            assert np.array_equal(series.x, [1., 2., 2., 3., 3., 4.])
+            assert np.array_equal(series.y, [1., 2., 2., 3., 9., 4.])
+
+
+def test_merge_into_spare_capacity_keeps_the_storage():
+    series = hkseries.Series()
+    series.reserve(100)
+    series.append(np.arange(50.), np.arange(50.))
+    storage = series._x
+    assert series.merge(np.array([10.5, 20.5]), np.array([-1., -2.])) == 11
+    assert series._x is storage
+    assert np.array_equal(series.x, np.sort(np.r_[np.arange(50.), 10.5,
+                                                  20.5]))
+    assert series.y[11] == -1 and series.y[22] == -2
+
+
+def test_conflicts_of_merged_regions_add_up_to_a_full_check():
+    rng = np.random.RandomState(2)
+    for dropDuplicates in (False, True):
+        series = hkseries.Series()
+        report = hkseries.ConflictReport()
+        for _ in range(30):
+            x = np.sort(rng.randint(0, 200, 20)).astype(float)
+            y = rng.randint(0, 3, 20).astype(float)
+            start = series.merge(x, y, dropDuplicates)
+            report.add('a', series.x, series.y, start)
+        full = hkseries.ConflictReport()
+        full.add('a', series.x, series.y)
+        assert report.duplicates == full.duplicates
+        assert np.array_equal(report.times(), full.times())
+        for new, old in zip(report.conflicts['a'], full.conflicts['a']):
+            assert np.array_equal(new, old)
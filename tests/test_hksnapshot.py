@@ -0,0 +1,32 @@
+import numpy as np
+
+import hkseries
+import hksnapshot
+
+
+def makeData():
+    x = np.arange(100) * hkseries.MINUTE
+    return {'THM A': hkseries.RetainedSeries(x, np.arange(100.)),
+            'THM B': hkseries.RetainedSeries(x, -np.arange(100.))}
+
+
+def test_snapshot_restores_the_data_of_its_mode(tmpdir):
+    fileName = str(tmpdir.join(hksnapshot.snapshotFile('fm')))
+    data = makeData()
+    hksnapshot.save(hksnapshot.capture(data, 'fm'), fileName)
+    restored = hksnapshot.load('fm', fileName)
+    assert sorted(restored) == sorted(data)
+    for sensor in data:
+        assert np.array_equal(restored[sensor].x, data[sensor].x)
+        assert np.array_equal(restored[sensor].y, data[sensor].y)
+
+
+def test_snapshot_of_another_mode_is_refused(tmpdir):
+    fileName = str(tmpdir.join('snapshot.npz'))
+    hksnapshot.save(hksnapshot.capture(makeData(), 'em'), fileName)
+    assert hksnapshot.load('fm', fileName) is None
+    assert hksnapshot.load('fm', str(tmpdir.join('missing.npz'))) is None
+
+
+def test_every_mode_has_its_own_snapshot():
+    assert hksnapshot.snapshotFile('em') != hksnapshot.snapshotFile('fm')
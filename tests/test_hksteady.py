@@ -0,0 +1,64 @@
+import numpy as np
+
+import hksteady
+
+MINUTE = hksteady.MINUTE
+
+
+def test_samples_leave_the_window_at_its_width():
+    window = hksteady.SlidingRange(10)
+    window.add(0, 5.)
+    window.add(5, 1.)
+    assert window.range() == 4
+    # The sample at 0 is exactly `width` older than the latest one
+    window.add(10, 2.)
+    assert [t for t, _ in window.samples] == [5, 10]
+    assert window.range() == 1
+    window.add(9.9, 1.5)
+    assert window.range() == 1
+    # Too old to matter
+    window.add(0, 100.)
+    assert window.range() == 1
+    window.add(float('nan'), float('nan'))
+    assert window.range() == 1
+
+
+def test_window_extrema_match_brute_force():
+    rng = np.random.RandomState(3)
+    times = np.cumsum(rng.rand(2000))
+    # A few samples out of order
+    swap = rng.randint(1, times.size, 50)
+    times[swap], times[swap - 1] = times[swap - 1], times[swap].copy()
+    values = rng.randint(0, 50, times.size).astype(float)
+    window = hksteady.SlidingRange(7.5)
+    seen = []
+    for t, y in zip(times, values):
+        window.add(t, y)
+        seen.append((t, y))
+        latest = max(s for s, _ in seen)
+        inWindow = [v for s, v in seen if latest - 7.5 < s]
+        assert window.range() == max(inWindow) - min(inWindow)
+
+
+def test_detector_reports_only_changes_of_state():
+    detector = hksteady.SteadyStateDetector(threshold=1, timeRange=10)
+    times = np.arange(30) * MINUTE
+    # Settles after a jump at minute 5
+    values = np.where(np.arange(30) < 5, 0., 20.)
+    changes = [detector.add('a', times[i:i + 1], values[i:i + 1])
+               for i in range(30)]
+    # Steady from the first sample on, not steady after the jump, and
+    # steady again once the jump is 10 minutes old
+    assert changes[0] is True
+    assert changes[5] is False
+    assert changes[15] is True
+    assert [c for c in changes if c is not None] == [True, False, True]
+    assert detector.add(hksteady.STATE_SENSORS[0], times, values) is None
+
+    # A looser definition only reports the sensors whose state changes
+    detector.add('b', times, values)
+    assert detector.steady == {'a': True, 'b': True}
+    changes = detector.configure(0.5, 20, {'a': (times, values),
+                                           'b': (times[:10], values[:10])})
+    assert changes == {'b': False}
+    assert detector.configure(0.5, 20, {'a': (times, values)}) == {}
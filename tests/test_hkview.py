@@ -0,0 +1,45 @@
+import numpy as np
+
+import hkseries
+import hkview
+
+SECOND = hkseries.MINUTE / 60
+
+
+def test_windowed_view_stays_blittable_until_data_leaves_it():
+    # Two hours of history, then one sample a second in a 30 minute window
+    start = 700000.
+    x = start + np.arange(7200) * SECOND
+    data = {'a': hkseries.RetainedSeries(x, np.sin(np.arange(7200) / 100.))}
+    view = hkview.LiveView()
+    xlim, ylim = view.adjust(data, (0., 1.), (0., 1.), 30.)
+    assert np.isclose(xlim[1] - xlim[0], 30 * hkseries.MINUTE)
+    assert xlim[0] > x[0]
+
+    moves = []
+    for frame in range(600):
+        t = x[-1] + (frame + 1) * SECOND
+        data['a'].append(t, np.sin((7200 + frame) / 100.))
+        limits = view.adjust(data, xlim, ylim, 30.)
+        if limits is not None:
+            moves.append(frame)
+            xlim, ylim = limits
+        assert xlim[0] <= t <= xlim[1]
+    # The view slides by a tenth of the window, i.e. every 3 minutes
+    assert len(moves) == 3
+    assert np.all(np.diff(moves) >= 179)
+
+
+def test_view_moves_for_new_values_out_of_range_and_width_changes():
+    x = 700000. + np.arange(100) * SECOND
+    data = {'a': hkseries.RetainedSeries(x, np.zeros(100))}
+    view = hkview.LiveView()
+    xlim, ylim = view.adjust(data, (0., 1.), (0., 1.), 30.)
+    assert view.adjust(data, xlim, ylim, 30.) is None
+
+    data['a'].append(x[-1] + SECOND, 10.)
+    xlim, ylim = view.adjust(data, xlim, ylim, 30.)
+    assert ylim[0] < 0 and ylim[1] > 10
+    data['a'].append(x[-1] + 2 * SECOND, 5.)
+    assert view.adjust(data, xlim, ylim, 30.) is None
+    assert view.adjust(data, xlim, ylim, 60.) is not None
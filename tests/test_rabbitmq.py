@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pika')
+
+import rabbitmq
+from localbroker import LocalBroker
+
+CONFIG = {'hostname': 'localhost', 'port': 5672, 'exchange': 'beacons',
+          'bindingKey': 'monitor', 'user': 'guest', 'pass': 'guest'}
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'Timed out'
+        time.sleep(0.005)
+
+
+class Consumer(object):
+    """
+    Runs an `AsyncRabbitMQClient` connected to `broker` on a thread and
+    records the bodies of the messages it handles. `handle`, if given, is
+    called with every body first.
+    """
+    def __init__(self, broker, handle=None, **kwargs):
+        self.client = rabbitmq.AsyncRabbitMQClient(
+            CONFIG, minBackoff=0.01, connect=broker.connect, **kwargs)
+        self.handle = handle
+        self.bodies = []
+        self.redelivered = []
+        self.thread = threading.Thread(target=self.client.start,
+                                       args=(self.callback,))
+        self.thread.daemon = True
+        self.thread.start()
+        waitFor(lambda: 'monitor' in broker.bindings[('beacons', 'THM')])
+
+
+    def callback(self, channel, method, properties, body):
+        if self.handle is not None:
+            self.handle(body)
+        self.bodies.append(body)
+        if method.redelivered:
+            self.redelivered.append(body)
+
+
+    def stop(self):
+        self.client.stop()
+        self.thread.join(5)
+        assert not self.thread.is_alive()
+
+
+def publish(broker, count, start=0):
+    bodies = [str(i) for i in range(start, start + count)]
+    for body in bodies:
+        broker.publish('beacons', 'THM', body)
+    return bodies
+
+
+def test_reconnect_redelivers_unacknowledged_messages():
+    broker = LocalBroker()
+    consumer = Consumer(broker, ackInterval=60)
+    first = publish(broker, 10)
+    waitFor(lambda: len(consumer.bodies) == 10)
+
+    broker.refuse(2)
+    broker.disconnect()
+    waitFor(lambda: len(consumer.bodies) == 20)
+    assert consumer.bodies == first + first
+    assert consumer.redelivered == first
+    assert consumer.client.metrics.reconnects == 3
+
+    second = publish(broker, 5, 10)
+    waitFor(lambda: len(consumer.bodies) == 25)
+    assert consumer.bodies[20:] == second
+    consumer.stop()
+    # Stopping acknowledges everything handled, so nothing is requeued
+    assert broker.pending('monitor') == 0
+
+
+def test_acks_are_batched():
+    broker = LocalBroker()
+    consumer = Consumer(broker, prefetch=10, ackEvery=4, ackInterval=60)
+    publish(broker, 10)
+    waitFor(lambda: len(consumer.bodies) == 10)
+    waitFor(lambda: len(broker.acks) == 2)
+    assert broker.acks == [(4, True), (8, True)]
+    assert consumer.client.metrics.acks == 8
+    consumer.stop()
+    assert broker.acks[2:] == [(10, True)]
+
+
+def test_ack_timer_acknowledges_a_partial_batch():
+    broker = LocalBroker()
+    consumer = Consumer(broker, ackEvery=100, ackInterval=0.05)
+    publish(broker, 3)
+    waitFor(lambda: broker.acks == [(3, True)])
+    consumer.stop()
+
+
+def test_prefetch_limits_messages_in_flight():
+    broker = LocalBroker()
+    release = threading.Event()
+    consumer = Consumer(broker, handle=lambda body: release.wait(5),
+                        prefetch=3, ackEvery=1)
+    publish(broker, 10)
+    waitFor(lambda: broker.pending('monitor') == 7)
+    time.sleep(0.05)
+    assert broker.pending('monitor') == 7
+    release.set()
+    waitFor(lambda: len(consumer.bodies) == 10)
+    assert broker.pending('monitor') == 0
+    consumer.stop()
+
+
+def test_timeouts_survive_reconnects():
+    broker = LocalBroker()
+    fired = []
+    consumer = Consumer(broker, ackEvery=1, handle=lambda body:
+                        consumer.client.addTimeout(0.3, lambda:
+                                                   fired.append(body)))
+    publish(broker, 1)
+    waitFor(lambda: broker.acks)
+    broker.disconnect()
+    waitFor(lambda: consumer.client.metrics.reconnects == 1)
+    waitFor(lambda: fired)
+    time.sleep(0.1)
+    assert fired == ['0']
+    consumer.stop()